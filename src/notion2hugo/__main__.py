@@ -2,7 +2,7 @@ import argparse
 import importlib
 import logging
 import tomllib
-from typing import Any, Dict, TextIO, Type
+from typing import Any, Dict, List, Optional, TextIO, Type
 
 from notion2hugo.base import IConfig
 from notion2hugo.runner import Runner, RunnerConfig
@@ -45,7 +45,7 @@ def validate_and_load_config(resource_config_file: TextIO) -> TConfig:
     return config
 
 
-def parse_input_args():
+def parse_input_args(args: Optional[List[str]] = None):
     readme = """
     Notion2Hugo: Export content written in Notion to markdown,
     compatible for [Hugo](https://gohugo.io/) blog.
@@ -58,7 +58,24 @@ def parse_input_args():
         help="Specify path to config.toml. "
         "Clone `src/notion2hugo/config.sample.toml` with custom settings.",
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Profile the run and write cpu (collapsed stacks), allocation and "
+        "event loop blocking reports to --profile-dir.",
+    )
+    parser.add_argument(
+        "--profile-dir",
+        default="/tmp/notion2hugo_profile",
+        help="Output dir of the profile reports (default: /tmp/notion2hugo_profile).",
+    )
+    parser.add_argument(
+        "--profile-top-n",
+        type=int,
+        default=25,
+        help="Number of allocation sites listed in the profile report.",
+    )
+    return parser.parse_args(args)
 
 
 def main():
@@ -84,10 +101,24 @@ def main():
         provider_config=provider_config_cls(**config["provider_config"]),
         formatter_config=formatter_config_cls(**config["formatter_config"]),
         exporter_config=exporter_config_cls(**config["exporter_config"]),
+        **{
+            k: v
+            for k, v in config["runner_config"].items()
+            if k not in VALID_CONFIG_STRUCT["runner_config"]
+        },
     )
     logger.info(f"Runner config = {runner_config}")
     runner = Runner(config=runner_config)
-    runner.run()
+    if args.profile:
+        # deferred, the profiler imports all the built-in handlers
+        from notion2hugo.profiler import ProfilerConfig, RunProfiler
+
+        profiler = RunProfiler(
+            ProfilerConfig(output_dir=args.profile_dir, top_n=args.profile_top_n)
+        )
+        profiler.run(runner)
+    else:
+        runner.run()
 
 
 if __name__ == "__main__":
@@ -20,12 +20,14 @@ Formatter (class)
 - Output: PageContent
 - Consumes PageContent produces by the Provider.
 - Modifies/transforms it appropriately and outputs it.
+- Optionally consumes a micro-batch of PageContent at once.
 
 Exporter (class)
 --------
 - Input: PageContent (from Formatter), ExporterConfig
 - Output: to DB/file system
 - Consumes content from Formatter and writes the content to db or file system.
+- Optionally consumes a micro-batch of PageContent at once.
 
 Runner
 --------
@@ -42,7 +44,7 @@ from abc import abstractmethod
 from collections.abc import MutableMapping
 from dataclasses import dataclass, field
 from enum import StrEnum
-from typing import AsyncIterator, List, Optional
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Set, Tuple
 
 from notion2hugo.registry import IConfig, IHandler, register_handler
 
@@ -51,6 +53,8 @@ Properties = MutableMapping[str, str | int | bool | List[str]]
 
 class BlobType(StrEnum):
     BULLETED_LIST_ITEM = "bulleted_list_item"
+    CHILD_DATABASE = "child_database"
+    CHILD_PAGE = "child_page"
     CODE = "code"
     DIVIDER = "divider"
     EQUATION = "equation"
@@ -58,10 +62,12 @@ class BlobType(StrEnum):
     HEADING_2 = "heading_2"
     HEADING_3 = "heading_3"
     IMAGE = "image"
+    LINK_TO_PAGE = "link_to_page"
     NEWLINE = "newline"  # default
     NUMBERED_LIST_ITEM = "numbered_list_item"
     PARAGRAPH = "paragraph"
     QUOTE = "quote"
+    SYNCED_BLOCK = "synced_block"
     TABLE = "table"
     TABLE_ROW = "table_row"
     TO_DO = "to_do"
@@ -77,6 +83,7 @@ class ContentWithAnnotation:
     code: bool = False
     color: str = "default"
     href: Optional[str] = None
+    page_ref: Optional[str] = None  # slug of the linked post, if exported
     is_equation: bool = False
     is_toggleable: bool = False
     is_caption: bool = False
@@ -97,6 +104,20 @@ class Blob:
     table_width: Optional[int]
     table_cells: Optional[List[List[ContentWithAnnotation]]]
     is_checked: Optional[bool]  # todo item
+    has_column_header: Optional[bool] = None  # table
+    html: Optional[str] = None  # pre-rendered, eg, highlighted code
+    content_hash: Optional[str] = None  # of the block subtree
+
+
+def iterate_blob_texts(blob: Optional[Blob]) -> Iterator[ContentWithAnnotation]:
+    # texts of the blob and its children, including table cells
+    if blob is None:
+        return
+    yield from blob.rich_text
+    for cell in blob.table_cells or []:
+        yield from cell
+    for child_blob in blob.children or []:
+        yield from iterate_blob_texts(child_blob)
 
 
 @dataclass(frozen=True)
@@ -106,6 +127,12 @@ class PageContent:
     properties: Properties
     footer: Optional[Blob] = None
     header: Optional[Blob] = None
+    # parent section dirs of the post, for nested pages
+    section: Tuple[str, ...] = ()
+    # has nested posts under it, exported as a hugo section
+    is_section: bool = False
+    # changes only if the exported post would, None if unknown
+    content_hash: Optional[str] = None
 
 
 @dataclass(frozen=True)
@@ -119,6 +146,19 @@ class BaseProvider(IHandler):
     def async_iterate(self) -> AsyncIterator[PageContent]:
         ...
 
+    def summary(self) -> Dict[str, Any]:
+        # provider specific stats, logged by the runner with the run summary
+        return {}
+
+    def get_page_ids(self) -> Optional[Set[str]]:
+        # ids of all the pages in the source, including the ones not yielded
+        # in this run, None if not known
+        return None
+
+    def cleanup(self) -> None:
+        # called by the runner once all pages are exported
+        pass
+
 
 @dataclass(frozen=True)
 class BaseFormatterConfig(IConfig):
@@ -131,6 +171,16 @@ class BaseFormatter(IHandler):
     async def async_process(self, content: PageContent) -> PageContent:
         ...
 
+    async def async_process_batch(
+        self, contents: List[PageContent]
+    ) -> List[PageContent]:
+        # default to processing one page at a time
+        return [await self.async_process(content) for content in contents]
+
+    def cleanup(self) -> None:
+        # called by the runner once all pages are exported
+        pass
+
 
 @dataclass(frozen=True)
 class BaseExporterConfig(IConfig):
@@ -142,3 +192,24 @@ class BaseExporter(IHandler):
     @abstractmethod
     async def async_process(self, content: PageContent) -> None:
         ...
+
+    async def async_process_batch(self, contents: List[PageContent]) -> None:
+        # default to processing one page at a time
+        for content in contents:
+            await self.async_process(content)
+
+    def has_output(self, content: PageContent) -> bool:
+        # whether the page exported by a previous run is still there, pages
+        # are only skipped as unchanged if so
+        return False
+
+    async def async_prune(self, page_ids: Set[str]) -> None:
+        # called by the runner with the ids of all the pages in the source,
+        # in order to drop the output of the pages removed from it
+        pass
+
+    async def async_finalize(self) -> Set[str]:
+        # called by the runner once all pages are exported, returns the ids of
+        # the pages whose output is incomplete, eg, with links to posts which
+        # weren't exported, never skipped as unchanged by the next run
+        return set()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+"""Adaptive concurrency limit for the requests issued against an API.
+
+The limit follows AIMD: it grows by ~1 per round trip while the observed
+latency stays within `latency_tolerance` of the minimum latency, and is cut
+multiplicatively when requests queue up server side (latency grows) or are
+throttled, at most once per round trip. The minimum latency slowly drifts
+upwards so that a backend which got slower for good is re-baselined.
+"""
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from notion2hugo.utils import get_logger
+
+
+@dataclass(frozen=True)
+class AdaptiveLimiterConfig:
+    initial_limit: int = 4
+    min_limit: int = 1
+    max_limit: int = 64
+    # latency above min latency * tolerance is treated as congestion
+    latency_tolerance: float = 1.5
+    # multiplicative decrease on congestion and throttling
+    backoff_ratio: float = 0.7
+    throttle_backoff_ratio: float = 0.5
+    # relative upward drift of the min latency per round trip
+    min_latency_drift: float = 0.002
+    max_retries: int = 5
+
+    def __post_init__(self):
+        assert (
+            1 <= self.min_limit <= self.initial_limit <= self.max_limit
+        ), f"Expected min_limit <= initial_limit <= max_limit, found {self}"
+
+
+class AdaptiveConcurrencyLimiter(object):
+    def __init__(
+        self,
+        config: AdaptiveLimiterConfig,
+        get_retry_after: Callable[[Exception], Optional[float]],
+    ):
+        """`get_retry_after` returns the seconds to wait before retrying if
+        the exception is a throttling response, None otherwise."""
+        self.logger = get_logger(__package__)
+        self.config = config
+        self.get_retry_after = get_retry_after
+        self.limit = float(config.initial_limit)
+        self.in_flight = 0
+        self.num_requests = 0
+        self.num_throttled = 0
+        self._start = time.monotonic()
+        self._last_decrease = self._start
+        self.min_latency: Optional[float] = None
+        self._condition = asyncio.Condition()
+        # (secs since start, limit) on every change of the integer limit
+        self.history: List[Tuple[float, int]] = [(0.0, config.initial_limit)]
+
+    def _set_limit(self, limit: float) -> None:
+        limit = min(max(limit, self.config.min_limit), self.config.max_limit)
+        if int(limit) != int(self.limit):
+            self.history.append((time.monotonic() - self._start, int(limit)))
+        self.limit = limit
+
+    def _decrease(self, ratio: float, latency: float) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < latency:
+            # already reacted to congestion within this round trip
+            return
+        self._last_decrease = now
+        self._set_limit(self.limit * ratio)
+
+    def on_success(self, latency: float) -> None:
+        self.min_latency = (
+            latency
+            if self.min_latency is None
+            else min(
+                latency,
+                # ~limit samples are collected per round trip
+                self.min_latency * (1 + self.config.min_latency_drift / self.limit),
+            )
+        )
+        if latency > self.min_latency * self.config.latency_tolerance:
+            self._decrease(self.config.backoff_ratio, latency)
+        elif self.in_flight >= int(self.limit):
+            # only grow when the current limit is actually used
+            self._set_limit(self.limit + 1 / self.limit)
+
+    def on_throttled(self, latency: float) -> None:
+        self.num_throttled += 1
+        self._decrease(self.config.throttle_backoff_ratio, latency)
+
+    async def _acquire(self) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def _release(self) -> None:
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    async def async_call(
+        self, function: Callable[..., Awaitable[Any]], *args: Any, **kwargs: Any
+    ) -> Any:
+        for attempt in range(self.config.max_retries + 1):
+            await self._acquire()
+            start = time.monotonic()
+            try:
+                result = await function(*args, **kwargs)
+            except Exception as e:
+                retry_after = self.get_retry_after(e)
+                if retry_after is None or attempt == self.config.max_retries:
+                    raise
+                self.on_throttled(time.monotonic() - start)
+            else:
+                self.num_requests += 1
+                self.on_success(time.monotonic() - start)
+                return result
+            finally:
+                await self._release()
+            self.logger.debug(f"Throttled, retrying in {retry_after}s")
+            await asyncio.sleep(retry_after)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "limit": int(self.limit),
+            "requests": self.num_requests,
+            "throttled": self.num_throttled,
+            "min_latency_secs": round(self.min_latency or 0, 4),
+            "history": [(round(t, 3), limit) for t, limit in self.history],
+        }
@@ -1,8 +1,9 @@
+import json
 import os
-import re
+import posixpath
 import shutil
-from dataclasses import dataclass
-from typing import List, Optional
+from dataclasses import asdict, dataclass, field, replace
+from typing import Dict, List, Optional, Set, Tuple
 
 from notion2hugo.base import (
     BaseExporter,
@@ -11,13 +12,15 @@ from notion2hugo.base import (
     BlobType,
     ContentWithAnnotation,
     PageContent,
+    iterate_blob_texts,
     register_handler,
 )
+from notion2hugo.taxonomy import TaxonomyIndex, TTerm
+from notion2hugo.utils import get_post_slug
 
 
-def sanitize_path(name: str) -> str:
-    pattern = re.compile(r"[^a-zA-Z0-9-_\.]")
-    return pattern.sub("", name)
+def get_relref(page_ref: str) -> str:
+    return f'{{{{< relref "{page_ref}" >}}}}'
 
 
 class MarkdownStyler:
@@ -42,7 +45,10 @@ class MarkdownStyler:
                 t = f"`{t}`"
             if text.color:
                 pass
-            if text.href:
+            if text.page_ref:
+                # link to another exported post
+                t = f"[{t}]({get_relref(text.page_ref)})"
+            elif text.href:
                 t = f"[{t}]({text.href})"
             if text.is_equation:
                 t = f"$ {t} $"
@@ -73,6 +79,9 @@ class MarkdownStyler:
 
     @classmethod
     def code(cls, blob: Blob, indent: int) -> str:
+        if blob.html:
+            # pre-highlighted by the formatter
+            return blob.html
         return "\n".join([f"```{blob.language}", cls.paragraph(blob, indent), "```"])
 
     @classmethod
@@ -112,6 +121,14 @@ class MarkdownStyler:
 
     @classmethod
     def table(cls, blob: Blob, indent: int) -> str:
+        if blob.file:
+            # rows exported to a data file next to the post, rendered by the
+            # `table-data` shortcode
+            header = "true" if blob.has_column_header else "false"
+            return (
+                f'{{{{< table-data src="{os.path.basename(blob.file)}" '
+                f'header="{header}" >}}}}'
+            )
         assert blob.table_width, f"table_width expected for TABLE blob {blob}"
         rows = []
         if blob.children:
@@ -146,6 +163,27 @@ class MarkdownStyler:
             f'caption="{caption}" align="center" >}}}}'
         )
 
+    @classmethod
+    def child_database(cls, blob: Blob, indent: int) -> str:
+        return cls.paragraph(blob, indent)
+
+    @classmethod
+    def child_page(cls, blob: Blob, indent: int) -> str:
+        return cls.paragraph(blob, indent)
+
+    @classmethod
+    def link_to_page(cls, blob: Blob, indent: int) -> str:
+        return cls.paragraph(blob, indent)
+
+    @classmethod
+    def synced_block(cls, blob: Blob, indent: int) -> str:
+        # rendered in place, as if the content was part of the page
+        texts = []
+        if blob.children:
+            for child_blob in blob.children:
+                texts.append(cls.process(child_blob, indent))
+        return "\n".join(texts)
+
     @classmethod
     def paragraph(cls, blob: Blob, indent: int) -> str:
         texts = [cls._style_content_with_annotation(blob.rich_text)]
@@ -172,79 +210,348 @@ class MarkdownExporterConfig(BaseExporterConfig):
     # use one of the page properties to determine post dir/file name
     # # if not specified, we default to using "id" as name
     post_name_property_key: Optional[str] = None
+    # properties indexed as taxonomies, eg, ["Tags", "Series"]
+    taxonomy_keys: List[str] = field(default_factory=list)
+    # sqlite db persisting the taxonomy index between runs
+    taxonomy_index_path: str = "/tmp/notion2hugo_taxonomy_index.sqlite"
+    # hugo data dir for the precomputed taxonomy terms and related posts
+    data_dir: Optional[str] = None
+    related_top_k: int = 5
+    # wipe the parent dir on start, disable for incremental runs which only
+    # export the changed pages (see content_hash_path)
+    clean_parent_dir: bool = True
+
+    def __post_init__(self):
+        assert (
+            not self.taxonomy_keys or self.data_dir
+        ), "data_dir expected in order to export taxonomy_keys."
+
+
+@dataclass(frozen=True)
+class ExportedPost:
+    # relative to the parent dir
+    path: str
+    file_name: str
+    # (post path, relref, href) of the posts it links to
+    page_refs: Tuple[Tuple[str, str, str], ...] = ()
 
 
 @register_handler(MarkdownExporterConfig)
 class MarkdownExporter(BaseExporter):
     POST_FILE_NAME: str = "index.md"
+    SECTION_FILE_NAME: str = "_index.md"
     POST_IMAGES_DIR: str = "images/"
+    # hidden files are ignored by hugo
+    POST_INDEX_FILE_NAME: str = ".notion2hugo_posts.json"
 
     def __init__(self, config: MarkdownExporterConfig):
         super(MarkdownExporter, self).__init__(config)
         self.config: MarkdownExporterConfig = config
-        self.logger.info(f"Clean up parent dir: {self.config.parent_dir}")
-        self.cleanup_parent_dir(self.config.parent_dir)
+        if self.config.clean_parent_dir:
+            self.logger.info(f"Clean up parent dir: {self.config.parent_dir}")
+            self.cleanup_parent_dir(self.config.parent_dir)
+        self.taxonomy_index = (
+            TaxonomyIndex(self.config.taxonomy_index_path)
+            if self.config.taxonomy_keys
+            else None
+        )
+        # page id -> post exported by this or previous runs, in order to
+        # remove the output of pages which moved or left the source
+        self.posts: Dict[str, ExportedPost] = self.load_post_index()
 
     def cleanup_parent_dir(self, parent_dir: str) -> None:
         if os.path.exists(parent_dir):
             shutil.rmtree(parent_dir)
 
+    def cleanup_post_images(self, post_dir: str) -> None:
+        # images of a previous export of the post, when the parent dir is kept
+        if not self.config.clean_parent_dir:
+            self.cleanup_parent_dir(os.path.join(post_dir, self.POST_IMAGES_DIR))
+
+    def get_post_index_path(self) -> str:
+        return os.path.join(self.config.parent_dir, self.POST_INDEX_FILE_NAME)
+
+    def load_post_index(self) -> Dict[str, ExportedPost]:
+        path = self.get_post_index_path()
+        if not os.path.exists(path):
+            return {}
+        with open(path) as fp:
+            return {
+                page_id: ExportedPost(
+                    path=post["path"],
+                    file_name=post["file_name"],
+                    page_refs=tuple(tuple(ref) for ref in post["page_refs"]),
+                )
+                for page_id, post in json.load(fp).items()
+            }
+
+    def save_post_index(self) -> None:
+        os.makedirs(self.config.parent_dir, exist_ok=True)
+        with open(self.get_post_index_path(), "w") as fp:
+            json.dump(
+                {page_id: asdict(post) for page_id, post in self.posts.items()},
+                fp,
+                indent=2,
+                sort_keys=True,
+            )
+
+    def remove_post_output(self, post: ExportedPost) -> None:
+        post_dir = os.path.join(self.config.parent_dir, post.path)
+        owners = [p for p in self.posts.values() if p.path == post.path]
+        if owners:
+            # taken over by another post, eg, a leaf page which became a
+            # section, only its stale post file is left
+            if all(p.file_name != post.file_name for p in owners):
+                self.remove_file(os.path.join(post_dir, post.file_name))
+            return
+        if not os.path.isdir(post_dir):
+            return
+        # files of the post, nested posts have their own dirs
+        for name in os.listdir(post_dir):
+            if os.path.isfile(os.path.join(post_dir, name)):
+                self.remove_file(os.path.join(post_dir, name))
+        self.cleanup_parent_dir(os.path.join(post_dir, self.POST_IMAGES_DIR))
+        # along with the sections left empty
+        parent_dir = os.path.abspath(self.config.parent_dir)
+        post_dir = os.path.abspath(post_dir)
+        while post_dir != parent_dir and not os.listdir(post_dir):
+            os.rmdir(post_dir)
+            post_dir = os.path.dirname(post_dir)
+        self.logger.info(f"Removed post '{post.path}/{post.file_name}'")
+
+    def remove_file(self, path: str) -> None:
+        if os.path.exists(path):
+            os.remove(path)
+
+    def update_post_index(self, content: PageContent) -> None:
+        post = ExportedPost(
+            path=self.get_post_path(content),
+            file_name=self.get_post_file_name(content),
+        )
+        prev_post = self.posts.get(content.id)
+        self.posts[content.id] = post
+        if prev_post and (prev_post.path, prev_post.file_name) != (
+            post.path,
+            post.file_name,
+        ):
+            # renamed, moved to another section or turned into a section
+            self.remove_post_output(prev_post)
+
     def make_output_dirs(self, parent_dir: str, *args: str) -> None:
         os.makedirs(os.path.join(parent_dir, *args), exist_ok=True)
 
-    async def async_process(self, content: PageContent) -> None:
-        # prepare post output dir structure
-        # parent_dir/
-        #     post_1/
-        #         images/
-        #         index.md
-        assert not self.config.post_name_property_key or content.properties.get(
-            self.config.post_name_property_key
-        ), (
-            f"{self.config.post_name_property_key} not a valid "
-            "property [{content.properties.keys()}]"
-        )
-        post_dir_name = (
-            content.properties[self.config.post_name_property_key]
-            if self.config.post_name_property_key
-            else content.id
+    def get_post_slug(self, content: PageContent) -> str:
+        return get_post_slug(
+            content.id, content.properties, self.config.post_name_property_key
         )
-        assert isinstance(post_dir_name, str), f"{post_dir_name} expected to be str"
-        post_dir_name = sanitize_path(post_dir_name)
-        post_images_dir = os.path.join(
-            self.config.parent_dir, post_dir_name, self.POST_IMAGES_DIR
+
+    def get_post_path(self, content: PageContent) -> str:
+        return posixpath.join(*content.section, self.get_post_slug(content))
+
+    def get_post_dir(self, content: PageContent) -> str:
+        return os.path.join(self.config.parent_dir, self.get_post_path(content))
+
+    def get_relative_ref(self, page_ref: str, post_path: str) -> str:
+        # page refs are post paths relative to the parent dir, hugo resolves
+        # relrefs relative to the linking post first, wherever the parent dir
+        # is within the site content
+        return posixpath.relpath(page_ref, post_path)
+
+    def get_post_file_name(self, content: PageContent) -> str:
+        return self.SECTION_FILE_NAME if content.is_section else self.POST_FILE_NAME
+
+    def has_output(self, content: PageContent) -> bool:
+        if content.id not in self.posts:
+            # eg, exported before the post index, its output can't be pruned
+            return False
+        if self.taxonomy_index and not self.taxonomy_index.has_page(content.id):
+            # eg, the index was deleted or rebuilt, its terms would be missing
+            return False
+        return os.path.exists(
+            os.path.join(self.get_post_dir(content), self.get_post_file_name(content))
         )
-        self.logger.debug(f"Creating output dir structure: {post_images_dir}")
-        self.make_output_dirs(post_images_dir)
-        post_full_path = os.path.join(
-            self.config.parent_dir, post_dir_name, self.POST_FILE_NAME
+
+    def index_terms(self, content: PageContent) -> None:
+        if not self.taxonomy_index:
+            return
+        terms: Set[TTerm] = set()
+        for key in self.config.taxonomy_keys:
+            value = content.properties.get(key)
+            values = value if isinstance(value, list) else [value]
+            terms.update((key, str(v)) for v in values if v)
+        self.taxonomy_index.update_page(content.id, self.get_post_path(content), terms)
+
+    def track_page_refs(self, content: PageContent) -> None:
+        post = self.posts[content.id]
+        page_refs = {
+            (
+                text.page_ref,
+                self.get_relative_ref(text.page_ref, post.path),
+                text.href or "",
+            )
+            for blob in [content.header, *content.blobs, content.footer]
+            for text in iterate_blob_texts(blob)
+            if text.page_ref
+        }
+        self.posts[content.id] = replace(post, page_refs=tuple(sorted(page_refs)))
+
+    def get_post_full_path(self, post: ExportedPost) -> str:
+        return os.path.join(self.config.parent_dir, post.path, post.file_name)
+
+    def unlink_missing_page_refs(self) -> Set[str]:
+        # links to posts which weren't exported, eg, skipped by the provider's
+        # time budget or removed since, would fail the hugo build, point them
+        # back to notion, in the posts of previous runs as well
+        existing = {
+            post.path
+            for post in self.posts.values()
+            if os.path.exists(self.get_post_full_path(post))
+        }
+        unlinked_page_ids: Set[str] = set()
+        for page_id, post in self.posts.items():
+            missing = [(r, h) for p, r, h in post.page_refs if p not in existing]
+            post_full_path = self.get_post_full_path(post)
+            if not missing or not os.path.exists(post_full_path):
+                continue
+            with open(post_full_path) as fp:
+                text = fp.read()
+            unlinked_text = text
+            for relref, href in missing:
+                unlinked_text = unlinked_text.replace(
+                    f"({get_relref(relref)})", f"({href})"
+                )
+            if unlinked_text == text:
+                # already unlinked by a previous run
+                continue
+            with open(post_full_path, "w") as fp:
+                fp.write(unlinked_text)
+            unlinked_page_ids.add(page_id)
+            self.logger.warning(
+                f"Unlinked {len(missing)} posts not exported from '{post_full_path}'"
+            )
+        return unlinked_page_ids
+
+    def relativize_page_refs(self, blob: Blob, post_path: str) -> Blob:
+        def relativize(text: ContentWithAnnotation) -> ContentWithAnnotation:
+            if not text.page_ref:
+                return text
+            return replace(
+                text, page_ref=self.get_relative_ref(text.page_ref, post_path)
+            )
+
+        return replace(
+            blob,
+            rich_text=[relativize(t) for t in blob.rich_text],
+            table_cells=[[relativize(t) for t in cell] for cell in blob.table_cells]
+            if blob.table_cells
+            else blob.table_cells,
+            children=[
+                self.relativize_page_refs(child_blob, post_path)
+                for child_blob in blob.children
+            ]
+            if blob.children
+            else blob.children,
         )
 
-        # prepare post content and write it out
+    def localize_files(self, blob: Blob, post_dir: str) -> Blob:
+        # copy the cached files to the post dir, the cached file may be
+        # shared by other pages (eg, synced blocks)
+        if blob.type == BlobType.IMAGE:
+            assert blob.file and os.path.exists(
+                blob.file
+            ), f"file expected for IMAGE blob {blob}"
+            new_img_path = shutil.copy(
+                blob.file, os.path.join(post_dir, self.POST_IMAGES_DIR)
+            )
+            return replace(blob, file=new_img_path)
+        if blob.type == BlobType.TABLE and blob.file:
+            # large table exported as a data file
+            return replace(blob, file=shutil.copy(blob.file, post_dir))
+        if blob.children:
+            return replace(
+                blob,
+                children=[
+                    self.localize_files(child_blob, post_dir)
+                    for child_blob in blob.children
+                ],
+            )
+        return blob
+
+    def render_post(self, content: PageContent, post_dir: str) -> str:
+        # prepare post content
         self.logger.debug("Processing blobs to prepare markdown content")
+        post_path = self.get_post_path(content)
         texts = []
         texts.append(MarkdownStyler.process(content.header))
         for blob in content.blobs:
-            if blob.type == BlobType.IMAGE:
-                # copy image to local dir
-                assert blob.file and os.path.exists(
-                    blob.file
-                ), f"file expected for IMAGE blob {blob}"
-                new_img_path = shutil.move(blob.file, post_images_dir)
-                blob = Blob(
-                    id=blob.id,
-                    rich_text=blob.rich_text,
-                    type=blob.type,
-                    children=blob.children,
-                    file=new_img_path,
-                    language=blob.language,
-                    table_width=blob.table_width,
-                    table_cells=blob.table_cells,
-                    is_checked=blob.is_checked,
-                )
-            texts.append(MarkdownStyler.process(blob))
+            blob = self.relativize_page_refs(blob, post_path)
+            texts.append(MarkdownStyler.process(self.localize_files(blob, post_dir)))
         texts.append(MarkdownStyler.process(content.footer))
+        return "\n".join(texts).strip()
+
+    async def async_process(self, content: PageContent) -> None:
+        await self.async_process_batch([content])
 
-        self.logger.info(f"Export post id={content.id} to path='{post_full_path}'")
-        with open(post_full_path, "w") as fp:
-            fp.write("\n".join(texts).strip())
+    async def async_process_batch(self, contents: List[PageContent]) -> None:
+        # prepare post output dir structure for the whole batch at once
+        # parent_dir/
+        #     post_1/
+        #         images/
+        #         index.md
+        #         table_<id>.csv (large tables)
+        #     section_1/ (nested pages)
+        #         images/
+        #         _index.md
+        #         post_2/
+        for content in contents:
+            self.update_post_index(content)
+        post_dirs = [self.get_post_dir(content) for content in contents]
+        for post_dir in set(post_dirs):
+            self.cleanup_post_images(post_dir)
+            self.make_output_dirs(post_dir, self.POST_IMAGES_DIR)
+        self.logger.debug(f"Created output dir structure for {len(post_dirs)} posts")
+
+        # render the whole batch before issuing the grouped writes
+        posts = [
+            (
+                os.path.join(post_dir, self.get_post_file_name(content)),
+                self.render_post(content, post_dir),
+            )
+            for post_dir, content in zip(post_dirs, contents)
+        ]
+        for (post_full_path, text), content in zip(posts, contents):
+            self.logger.debug(f"Export post id={content.id} to path='{post_full_path}'")
+            with open(post_full_path, "w") as fp:
+                fp.write(text)
+        for content in contents:
+            self.index_terms(content)
+            self.track_page_refs(content)
+        self.logger.info(
+            f"Export {len(posts)} posts to parent dir='{self.config.parent_dir}'"
+        )
+
+    async def async_prune(self, page_ids: Set[str]) -> None:
+        # pages deleted from the source, or filtered out of it
+        removed_posts = [self.posts.pop(i) for i in set(self.posts) - page_ids]
+        for post in removed_posts:
+            self.remove_post_output(post)
+        if removed_posts:
+            self.logger.info(f"Removed {len(removed_posts)} posts not in the source")
+        if not self.taxonomy_index:
+            return
+        removed = self.taxonomy_index.get_page_ids() - page_ids
+        for page_id in removed:
+            self.taxonomy_index.remove_page(page_id)
+        if removed:
+            self.logger.info(f"Removed {len(removed)} pages from the taxonomy index")
+
+    async def async_finalize(self) -> Set[str]:
+        unlinked_page_ids = self.unlink_missing_page_refs()
+        self.save_post_index()
+        if self.taxonomy_index:
+            assert self.config.data_dir
+            self.taxonomy_index.write_data_files(
+                self.config.data_dir, self.config.related_top_k
+            )
+            self.taxonomy_index.close()
+        return unlinked_page_ids
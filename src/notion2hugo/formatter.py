@@ -1,4 +1,11 @@
-from dataclasses import dataclass
+import asyncio
+import hashlib
+import importlib.util
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, replace
+from typing import Dict, List, Optional, Set, Tuple
 
 from notion2hugo.base import (
     BaseFormatter,
@@ -10,10 +17,50 @@ from notion2hugo.base import (
     register_handler,
 )
 
+# (code, language, style)
+TCodeKey = Tuple[str, str, str]
+
+
+def highlight_code(code: str, language: str, style: str) -> str:
+    # imported lazily, pygments is an optional dependency
+    from pygments import highlight
+    from pygments.formatters import HtmlFormatter
+    from pygments.lexers import TextLexer, get_lexer_by_name
+    from pygments.util import ClassNotFound
+
+    try:
+        lexer = get_lexer_by_name(language)
+    except ClassNotFound:
+        lexer = TextLexer()
+    # inline styles, so that no extra css is required by the theme
+    return highlight(code, lexer, HtmlFormatter(style=style, noclasses=True))
+
+
+def to_html_block(html: str) -> str:
+    # a markdown html block ends at the first blank line, keep it on a single
+    # line, newlines only occur within <pre> where they are preserved
+    return html.strip("\n").replace("\n", "&#10;")
+
 
 @dataclass(frozen=True)
 class HugoFormatterConfig(BaseFormatterConfig):
-    pass
+    # pre-render code blocks to static html instead of leaving them to hugo
+    highlight_code: bool = False
+    highlight_style: str = "monokai"
+    highlight_cache_dir: str = "/tmp/notion2hugo_highlight_cache"
+    # worker processes used to highlight, 0 to highlight in the event loop
+    highlight_workers: int = 0
+    # left as fenced blocks, eg, rendered by a hugo render hook
+    highlight_skip_languages: List[str] = field(default_factory=lambda: ["mermaid"])
+
+    def __post_init__(self):
+        assert not self.highlight_code or importlib.util.find_spec("pygments"), (
+            "highlight_code requires pygments, "
+            "install it with `pip install notion2hugo[highlight]`"
+        )
+        assert (
+            self.highlight_workers >= 0
+        ), f"highlight_workers={self.highlight_workers} not valid."
 
 
 @register_handler(HugoFormatterConfig)
@@ -21,8 +68,101 @@ class HugoFormatter(BaseFormatter):
     def __init__(self, config: HugoFormatterConfig):
         super(HugoFormatter, self).__init__(config)
         self.config: HugoFormatterConfig = config
+        self.executor: Optional[ProcessPoolExecutor] = None
+        if self.config.highlight_code:
+            os.makedirs(self.config.highlight_cache_dir, exist_ok=True)
+            if self.config.highlight_workers:
+                self.executor = ProcessPoolExecutor(self.config.highlight_workers)
 
     async def async_process(self, content: PageContent) -> PageContent:
+        if self.config.highlight_code:
+            (content,) = await self.async_highlight_pages([content])
+        return self.format_page(content)
+
+    async def async_process_batch(
+        self, contents: List[PageContent]
+    ) -> List[PageContent]:
+        if self.config.highlight_code:
+            contents = await self.async_highlight_pages(contents)
+        return [self.format_page(content) for content in contents]
+
+    def get_code_key(self, blob: Blob) -> Optional[TCodeKey]:
+        language = blob.language or "plain text"
+        if language in self.config.highlight_skip_languages:
+            return None
+        code = "".join(t.plain_text or "" for t in blob.rich_text)
+        return (code, language, self.config.highlight_style)
+
+    def collect_code_keys(
+        self, blobs: Optional[List[Blob]], keys: Set[TCodeKey]
+    ) -> None:
+        for blob in blobs or []:
+            if blob.type == BlobType.CODE:
+                key = self.get_code_key(blob)
+                if key:
+                    keys.add(key)
+            self.collect_code_keys(blob.children, keys)
+
+    def get_cache_path(self, key: TCodeKey) -> str:
+        digest = hashlib.sha256("\0".join(key).encode()).hexdigest()
+        return os.path.join(self.config.highlight_cache_dir, f"{digest}.html")
+
+    async def async_highlight(self, key: TCodeKey) -> str:
+        cache_path = self.get_cache_path(key)
+        if os.path.exists(cache_path):
+            with open(cache_path) as fp:
+                return to_html_block(fp.read())
+        if self.executor:
+            html = await asyncio.get_running_loop().run_in_executor(
+                self.executor, highlight_code, *key
+            )
+        else:
+            html = highlight_code(*key)
+        # write atomically, the cache dir may be shared by concurrent runs
+        fd, tmp_path = tempfile.mkstemp(dir=self.config.highlight_cache_dir)
+        with os.fdopen(fd, "w") as fp:
+            fp.write(html)
+        os.replace(tmp_path, cache_path)
+        return to_html_block(html)
+
+    def replace_code_blobs(
+        self, blobs: Optional[List[Blob]], htmls: Dict[TCodeKey, str]
+    ) -> Optional[List[Blob]]:
+        if not blobs:
+            return blobs
+        new_blobs = []
+        for blob in blobs:
+            key = self.get_code_key(blob) if blob.type == BlobType.CODE else None
+            if key:
+                blob = replace(blob, html=htmls[key])
+            elif blob.children:
+                blob = replace(
+                    blob, children=self.replace_code_blobs(blob.children, htmls)
+                )
+            new_blobs.append(blob)
+        return new_blobs
+
+    async def async_highlight_pages(
+        self, contents: List[PageContent]
+    ) -> List[PageContent]:
+        # unique snippets across the batch, highlighted concurrently
+        keys: Set[TCodeKey] = set()
+        for content in contents:
+            self.collect_code_keys(content.blobs, keys)
+        if not keys:
+            return contents
+        htmls = dict(zip(keys, await asyncio.gather(*map(self.async_highlight, keys))))
+        return [
+            replace(content, blobs=self.replace_code_blobs(content.blobs, htmls))
+            for content in contents
+        ]
+
+    def cleanup(self) -> None:
+        if self.executor:
+            self.executor.shutdown()
+            self.executor = None
+
+    def format_page(self, content: PageContent) -> PageContent:
         # process properties and format header
         header_props = [f"# ID: {content.id}"]
         header_props.extend(
@@ -50,4 +190,6 @@ class HugoFormatter(BaseFormatter):
             properties=content.properties,
             footer=None,
             header=header_blob,
+            section=content.section,
+            is_section=content.is_section,
         )
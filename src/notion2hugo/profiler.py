@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+
+"""Profiles a run, attributing cpu, allocations and event loop blocking to
+the pipeline stages.
+
+Reports written to the output dir:
+- cpu.collapsed: sampled stacks in collapsed format, for flamegraph.pl/speedscope
+- blocking.collapsed: stacks sampled while a callback was holding the event loop
+- allocations.txt: top-N allocation sites at the traced memory peak
+- summary.txt: per-stage cpu samples, allocations and event loop blocking
+"""
+import asyncio
+import inspect
+import os
+import selectors
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from dataclasses import dataclass, field
+from types import FrameType
+from typing import Any, Coroutine, Dict, List, Optional, Tuple
+
+from notion2hugo import exporter, formatter, provider, taxonomy
+from notion2hugo.exporter import MarkdownStyler
+from notion2hugo.provider import NotionParser, normalize_block_content
+from notion2hugo.runner import Runner
+from notion2hugo.utils import get_logger
+
+# (filename, first line, last line)
+TSourceSpan = Tuple[str, int, int]
+
+OTHER_STAGE = "other"
+# event loop waiting on the selector, ie, for the network or a timer
+IDLE_STAGE = "idle"
+# the innermost matching frame wins, the narrowest span within a frame,
+# e.g. NotionParser within the provider module
+STAGES: Dict[str, List[Any]] = {
+    "provider_fetch": [provider],
+    "parse": [
+        NotionParser,
+        normalize_block_content,
+        *provider._PROPERTY_EXTRACTORS.values(),
+    ],
+    "formatter": [formatter],
+    "styler": [MarkdownStyler],
+    "exporter_io": [exporter, taxonomy],
+}
+
+
+def get_source_span(obj: Any) -> TSourceSpan:
+    # modules start at line 0
+    lines, first = inspect.getsourcelines(obj)
+    return (inspect.getsourcefile(obj) or "", first, first + len(lines) - 1)
+
+
+@dataclass(frozen=True)
+class ProfilerConfig:
+    output_dir: str
+    sample_interval_secs: float = 0.005
+    # callbacks holding the event loop longer than this are reported
+    block_threshold_secs: float = 0.1
+    top_n: int = 25
+    traceback_limit: int = 32
+
+
+@dataclass
+class LoopBlockingStats:
+    count: int = 0
+    total_secs: float = 0.0
+    max_secs: float = 0.0
+    stacks: Counter = field(default_factory=Counter)
+
+
+class RunProfiler(object):
+    def __init__(self, config: ProfilerConfig):
+        self.logger = get_logger(__package__)
+        self.config = config
+        self.spans: Dict[str, List[TSourceSpan]] = {
+            stage: [get_source_span(obj) for obj in objs]
+            for stage, objs in STAGES.items()
+        }
+        self.cpu_stacks: Counter = Counter()
+        self.cpu_stages: Counter = Counter()
+        self.idle_samples = 0
+        self.blocking = LoopBlockingStats()
+        self.peak_snapshot: Optional[tracemalloc.Snapshot] = None
+        self.peak_traced_bytes = 0
+        self._last_beat = time.monotonic()
+        self._stop = threading.Event()
+
+    def get_stage(self, frames: List[Tuple[str, int]]) -> str:
+        # frames are ordered innermost first
+        for filename, lineno in frames:
+            matches = [
+                (last - first, stage)
+                for stage, spans in self.spans.items()
+                for span_file, first, last in spans
+                if filename == span_file and first <= lineno <= last
+            ]
+            if matches:
+                return min(matches)[1]
+        return OTHER_STAGE
+
+    def sample_stack(self, frame: Optional[FrameType]) -> Tuple[str, str]:
+        if frame is not None and frame.f_code.co_filename == selectors.__file__:
+            return "", IDLE_STAGE
+        names: List[str] = []
+        frames: List[Tuple[str, int]] = []
+        while frame is not None:
+            code = frame.f_code
+            module = os.path.splitext(os.path.basename(code.co_filename))[0]
+            names.append(f"{module}:{code.co_qualname}")
+            frames.append((code.co_filename, frame.f_lineno))
+            frame = frame.f_back
+        return ";".join(reversed(names)), self.get_stage(frames)
+
+    def _sample(self, thread_id: int) -> None:
+        # runs in a background thread, sampling the event loop thread
+        block_threshold = self.config.block_threshold_secs
+        while not self._stop.wait(self.config.sample_interval_secs):
+            frame = sys._current_frames().get(thread_id)
+            stack, stage = self.sample_stack(frame)
+            if stage == IDLE_STAGE:
+                # waiting on i/o isn't cpu, reported separately
+                self.idle_samples += 1
+                continue
+            self.cpu_stacks[stack] += 1
+            self.cpu_stages[stage] += 1
+            if time.monotonic() - self._last_beat > block_threshold:
+                self.blocking.stacks[stack] += 1
+
+            traced_bytes, _ = tracemalloc.get_traced_memory()
+            if traced_bytes > 1.1 * self.peak_traced_bytes:
+                self.peak_traced_bytes = traced_bytes
+                self.peak_snapshot = tracemalloc.take_snapshot()
+
+    async def _heartbeat(self) -> None:
+        interval = self.config.block_threshold_secs / 4
+        while True:
+            self._last_beat = time.monotonic()
+            await asyncio.sleep(interval)
+            lag = time.monotonic() - self._last_beat - interval
+            if lag > self.config.block_threshold_secs:
+                self.blocking.count += 1
+                self.blocking.total_secs += lag
+                self.blocking.max_secs = max(self.blocking.max_secs, lag)
+
+    async def async_profile(self, coro: Coroutine[Any, Any, None]) -> None:
+        tracemalloc.start(self.config.traceback_limit)
+        sampler = threading.Thread(
+            target=self._sample, args=(threading.get_ident(),), daemon=True
+        )
+        heartbeat = asyncio.create_task(self._heartbeat())
+        start = time.monotonic()
+        sampler.start()
+        try:
+            await coro
+        finally:
+            wall_secs = time.monotonic() - start
+            heartbeat.cancel()
+            self._stop.set()
+            sampler.join()
+            if self.peak_snapshot is None:
+                self.peak_snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            self.write_reports(wall_secs)
+
+    def run(self, runner: Runner) -> None:
+        asyncio.run(self.async_profile(runner.async_run()))
+
+    def write_collapsed(self, path: str, stacks: Counter) -> None:
+        with open(path, "w") as fp:
+            for stack, count in stacks.most_common():
+                fp.write(f"{stack} {count}\n")
+
+    def write_reports(self, wall_secs: float) -> None:
+        assert self.peak_snapshot is not None
+        os.makedirs(self.config.output_dir, exist_ok=True)
+        self.write_collapsed(
+            os.path.join(self.config.output_dir, "cpu.collapsed"), self.cpu_stacks
+        )
+        self.write_collapsed(
+            os.path.join(self.config.output_dir, "blocking.collapsed"),
+            self.blocking.stacks,
+        )
+
+        # allocations live at the traced peak, attributed to stages
+        snapshot = self.peak_snapshot.filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)]
+        )
+        alloc_stages: Counter = Counter()
+        for stat in snapshot.statistics("traceback"):
+            frames = [(f.filename, f.lineno) for f in reversed(stat.traceback)]
+            alloc_stages[self.get_stage(frames)] += stat.size
+        with open(os.path.join(self.config.output_dir, "allocations.txt"), "w") as fp:
+            fp.write(f"Traced memory peak: {self.peak_traced_bytes} bytes\n")
+            fp.write(f"Top {self.config.top_n} allocation sites at peak:\n")
+            for stat in snapshot.statistics("lineno")[: self.config.top_n]:
+                fp.write(f"{stat}\n")
+
+        total_samples = sum(self.cpu_stages.values()) or 1
+        idle_percent = 100 * self.idle_samples / (total_samples + self.idle_samples)
+        summary = [
+            f"Wall time: {wall_secs:.3f}s",
+            f"CPU samples: {total_samples} "
+            f"every {self.config.sample_interval_secs}s",
+            f"Event loop idle (waiting on i/o): {self.idle_samples} samples, "
+            f"{idle_percent:.1f}% of wall time",
+            "",
+            f"{'stage':<16}{'cpu %':>8}{'alloc bytes':>16}",
+        ]
+        for stage in [*STAGES, OTHER_STAGE]:
+            summary.append(
+                f"{stage:<16}"
+                f"{100 * self.cpu_stages[stage] / total_samples:>8.1f}"
+                f"{alloc_stages[stage]:>16}"
+            )
+        summary.extend(
+            [
+                "",
+                f"Event loop blocked > {self.config.block_threshold_secs}s: "
+                f"{self.blocking.count} times, "
+                f"total {self.blocking.total_secs:.3f}s, "
+                f"max {self.blocking.max_secs:.3f}s",
+            ]
+        )
+        with open(os.path.join(self.config.output_dir, "summary.txt"), "w") as fp:
+            fp.write("\n".join(summary) + "\n")
+        self.logger.info(
+            "Profile summary:\n"
+            + "\n".join(summary)
+            + f"\nReports written to '{self.config.output_dir}'"
+        )
@@ -2,15 +2,34 @@
 
 """Defines the top level abstraction which encapsulates export logic."""
 import asyncio
+import csv
+import hashlib
+import json
+import logging
 import os
+import re
 import shutil
 import tempfile
-from dataclasses import asdict, dataclass, field, fields
+import time
+from dataclasses import asdict, dataclass, field, fields, replace
+from enum import StrEnum
+from functools import partial
 from pprint import pformat
-from typing import Any, AsyncIterator, Dict, List, Optional
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
 
 import requests
 from notion_client import AsyncClient
+from notion_client.errors import APIErrorCode, APIResponseError
 from notion_client.helpers import async_iterate_paginated_api
 
 from notion2hugo import NOTION_DATABASE_ID, NOTION_TOKEN
@@ -22,8 +41,17 @@ from notion2hugo.base import (
     ContentWithAnnotation,
     PageContent,
     Properties,
+    iterate_blob_texts,
     register_handler,
 )
+from notion2hugo.concurrency import AdaptiveConcurrencyLimiter, AdaptiveLimiterConfig
+from notion2hugo.utils import (
+    SingleFlightCache,
+    combine_hashes,
+    get_content_hash,
+    get_logger,
+    get_post_slug,
+)
 
 
 @dataclass(frozen=True)
@@ -52,21 +80,192 @@ class NotionBlockData:
     children: Optional[List["NotionBlockData"]]
 
 
+def get_retry_after(e: Exception) -> Optional[float]:
+    if isinstance(e, APIResponseError) and e.code == APIErrorCode.RateLimited:
+        return float(e.headers.get("retry-after", 1))
+    return None
+
+
+def normalize_block_content(content: Any) -> Any:
+    # notion hosted files come with a signed url which, along with its
+    # expiry, changes on every fetch while the file doesn't
+    if isinstance(content, dict):
+        if "expiry_time" in content and isinstance(content.get("url"), str):
+            content = {**content, "url": content["url"].split("?", 1)[0]}
+        return {
+            k: normalize_block_content(v)
+            for k, v in content.items()
+            if k != "expiry_time"
+        }
+    if isinstance(content, list):
+        return [normalize_block_content(v) for v in content]
+    return content
+
+
+def get_notion_url(page_id: str) -> str:
+    return f"https://www.notion.so/{page_id.replace('-', '')}"
+
+
+def normalize_page_id(page_id: str) -> str:
+    return page_id.replace("-", "").lower()
+
+
+_NOTION_PAGE_URL = re.compile(
+    r"^(?:https?://(?:www\.)?notion\.(?:so|site)|https?://[\w-]+\.notion\.site)?"
+    r"/(?:[^?#]*[/-])?([0-9a-fA-F]{32}|[0-9a-fA-F-]{36})(?:[?#].*)?$"
+)
+
+
+def get_page_id_from_url(url: str) -> Optional[str]:
+    # eg, /2a.., https://www.notion.so/Post-Title-2a..?pvs=4
+    match = _NOTION_PAGE_URL.match(url)
+    return normalize_page_id(match.group(1)) if match else None
+
+
+def _extract_title(c: List[Dict[str, Any]]) -> str | List[str]:
+    values = ["'" + t["plain_text"] + "'" for t in c]
+    return values[0] if len(values) == 1 else values
+
+
+def _extract_names(c: List[Dict[str, Any]]) -> List[str]:
+    # multi_select, people, files
+    return [t["name"] for t in c if t.get("name") is not None]
+
+
+def _extract_name(c: Optional[Dict[str, Any]]) -> Optional[str]:
+    # select, status, created_by, last_edited_by
+    return c.get("name") if c else None
+
+
+def _extract_typed(c: Optional[Dict[str, Any]]) -> Any:
+    # formula, rollup
+    return c.get(c["type"]) if c else None
+
+
+def _extract_date(c: Optional[Dict[str, Any]]) -> Optional[str]:
+    return c.get("start") if c else None
+
+
+def _extract_unique_id(c: Dict[str, Any]) -> str | int | None:
+    if c.get("prefix"):
+        return f"{c['prefix']}_{c['number']}"
+    return c.get("number")
+
+
+def _extract_value(c: Any) -> Any:
+    # checkbox, number, url, email, phone_number, created_time, last_edited_time
+    return c
+
+
+_PROPERTY_EXTRACTORS: Dict[str, Callable[[Any], Any]] = {
+    "checkbox": _extract_value,
+    "created_by": _extract_name,
+    "created_time": _extract_value,
+    "date": _extract_date,
+    "email": _extract_value,
+    "files": _extract_names,
+    "formula": _extract_typed,
+    "last_edited_by": _extract_name,
+    "last_edited_time": _extract_value,
+    "multi_select": _extract_names,
+    "number": _extract_value,
+    "people": _extract_names,
+    "phone_number": _extract_value,
+    "rollup": _extract_typed,
+    "select": _extract_name,
+    "status": _extract_name,
+    "title": _extract_title,
+    "unique_id": _extract_unique_id,
+    "url": _extract_value,
+}
+# properties which never make it to the front matter
+_SKIPPED_PROPERTY_TYPES = ("relation", "rich_text")
+# properties bumped by merely opening or touching the page
+_VOLATILE_PROPERTY_TYPES = ("last_edited_by", "last_edited_time")
+
+
+@dataclass(frozen=True)
+class PropertyExtractor:
+    key: str
+    output_key: str
+    type: str
+    extract: Callable[[Any], Any]
+
+
 class NotionParser:
     def __init__(self, tmp_cache_dir: str):
         self.tmp_cache_dir = tmp_cache_dir
+        self.logger = get_logger(__package__)
+        self.property_extractors: Optional[List[PropertyExtractor]] = None
+        # images shared across pages (eg, synced blocks) are downloaded once
+        self.downloaded_images: Dict[str, str] = {}
+        # page id -> post path (slug within its sections), for pages
+        # exported in this run
+        self.page_index: Dict[str, str] = {}
+
+    def set_schema(self, schema: Dict[str, Any]) -> None:
+        self.property_extractors = self.compile_property_extractors(schema)
+
+    def get_page_ref(self, href: Optional[str]) -> Optional[str]:
+        if not href or not self.page_index:
+            return None
+        page_id = get_page_id_from_url(href)
+        return self.page_index.get(page_id) if page_id else None
+
+    def resolve_page_ref(self, text: ContentWithAnnotation) -> ContentWithAnnotation:
+        page_ref = self.get_page_ref(text.href)
+        return text if page_ref == text.page_ref else replace(text, page_ref=page_ref)
+
+    def resolve_page_refs(self, blobs: Optional[List[Blob]]) -> Optional[List[Blob]]:
+        # for pages indexed after the blobs were parsed, eg, while crawling
+        if not blobs:
+            return blobs
+        return [
+            replace(
+                blob,
+                rich_text=[self.resolve_page_ref(t) for t in blob.rich_text],
+                table_cells=[
+                    [self.resolve_page_ref(t) for t in cell]
+                    for cell in blob.table_cells
+                ]
+                if blob.table_cells
+                else blob.table_cells,
+                children=self.resolve_page_refs(blob.children),
+            )
+            for blob in blobs
+        ]
 
-    def parse_block(self, block: NotionBlockData) -> Blob:
+    def parse_block(
+        self, block: NotionBlockData, children: Optional[List[Blob]] = None
+    ) -> Blob:
+        # children are either already parsed or parsed along with the block
+        if children is None and block.children:
+            children = [self.parse_block(c) for c in block.children]
         table_cells = None
         img_path = None
         rich_text = []
 
-        if block.content.get("rich_text"):
+        if block.type in (
+            BlobType.CHILD_DATABASE,
+            BlobType.CHILD_PAGE,
+            BlobType.LINK_TO_PAGE,
+        ):
+            # link to the page, title and url are resolved by the provider
+            href = block.content.get("url", get_notion_url(block.id))
+            rich_text = [
+                ContentWithAnnotation(
+                    plain_text=block.content.get("title"),
+                    href=href,
+                    page_ref=self.get_page_ref(href),
+                )
+            ]
+        elif block.content.get("rich_text"):
             # majority of elems
             rich_text = [
                 ContentWithAnnotation(
                     plain_text=t.get("plain_text"),
                     href=t.get("href"),
+                    page_ref=self.get_page_ref(t.get("href")),
                     is_equation=t.get("type") == "equation",
                     is_toggleable=block.content.get("is_toggleable", False),
                     **t.get("annotations", {}),
@@ -80,6 +279,7 @@ class NotionParser:
                     is_caption=True,
                     plain_text=t.get("plain_text"),
                     href=t.get("href"),
+                    page_ref=self.get_page_ref(t.get("href")),
                     **t.get("annotations", {}),
                 )
                 for t in block.content.get("caption", [])
@@ -98,6 +298,7 @@ class NotionParser:
                     ContentWithAnnotation(
                         plain_text=t.get("plain_text"),
                         href=t.get("href"),
+                        page_ref=self.get_page_ref(t.get("href")),
                         **t.get("annotations", {}),
                     )
                     for t in cell
@@ -109,17 +310,18 @@ class NotionParser:
             id=block.id,
             rich_text=rich_text,
             type=block.type,
-            children=[self.parse_block(c) for c in block.children]
-            if block.children
-            else None,
+            children=children or None,
             file=img_path,
             language=block.content.get("language", None),  # code block
             table_width=block.content.get("table_width"),  # table
+            has_column_header=block.content.get("has_column_header"),
             table_cells=table_cells,
             is_checked=block.content.get("checked", None),  # todo
         )
 
     def download_image_locally(self, url: str) -> str:
+        if url in self.downloaded_images:
+            return self.downloaded_images[url]
         with requests.get(url, stream=True) as response:
             content_type = response.headers["Content-Type"].split("/")
             assert (
@@ -133,57 +335,169 @@ class NotionParser:
                 local_path = fp.name
                 for chunk in response.iter_content(chunk_size=10 * 1024):
                     fp.write(chunk)
+        self.downloaded_images[url] = local_path
         return local_path
 
-    def parse_properties(self, metadata: Dict[str, Any]) -> Properties:
-        prop: Properties = {}
-        for k, v in metadata.items():
-            if v["type"] in ("relation"):
-                # relation
+    def compile_property_extractors(
+        self, schema: Dict[str, Any]
+    ) -> List[PropertyExtractor]:
+        # resolve each property type once, dropping the ones never emitted
+        extractors: List[PropertyExtractor] = []
+        for k, v in schema.items():
+            prop_type = v["type"]
+            if prop_type in _SKIPPED_PROPERTY_TYPES:
                 continue
-            elif v["type"] == "title":
-                # title
-                values = ["'" + c["plain_text"] + "'" for c in v["title"]]
-                prop["Title"] = values[0] if len(values) == 1 else values
+            if prop_type not in _PROPERTY_EXTRACTORS:
+                self.logger.debug(f"Property {k} of type {prop_type} not handled.")
                 continue
-            c = v.get(v["type"], {})
-            if not c or isinstance(c, (str, int, bool)):
-                # last_edited_time, created_time
-                prop[k] = c
-            elif isinstance(c, (list, tuple)):
-                # multi_select
-                prop[k] = list(
-                    filter(lambda x: x is not None, [t.get("name") for t in c])
+            extractors.append(
+                PropertyExtractor(
+                    key=k,
+                    output_key="Title" if prop_type == "title" else k,
+                    type=prop_type,
+                    extract=_PROPERTY_EXTRACTORS[prop_type],
                 )
-            elif isinstance(c, dict):
-                if c.get("name"):
-                    # select, status,
-                    value = c["name"]
-                elif c.get("type"):
-                    # formula
-                    value = c[c["type"]]
-                elif c.get("prefix") and c.get("number"):
-                    # unique_id
-                    value = f"{c['prefix']}_{c['number']}"
-                elif c.get("start"):
-                    # date
-                    value = c["start"]
-                prop[k] = value
-            else:
-                raise NotImplementedError(f"{k}, {v} type not handled")
+            )
+        return extractors
+
+    def parse_properties(
+        self,
+        metadata: Dict[str, Any],
+        extractors: Optional[List[PropertyExtractor]] = None,
+    ) -> Properties:
+        if extractors is None:
+            extractors = self.property_extractors or self.compile_property_extractors(
+                metadata
+            )
+        prop: Properties = {}
+        for extractor in extractors:
+            v = metadata.get(extractor.key)
+            if v is None or v["type"] != extractor.type:
+                # property missing on the page or schema changed mid-run
+                continue
+            prop[extractor.output_key] = extractor.extract(v[extractor.type])
         return prop
 
+    def get_properties_hash(
+        self,
+        properties: Properties,
+        extractors: Optional[List[PropertyExtractor]] = None,
+    ) -> str:
+        if extractors is None:
+            extractors = self.property_extractors or []
+        volatile_keys = {
+            e.output_key for e in extractors if e.type in _VOLATILE_PROPERTY_TYPES
+        }
+        return get_content_hash(
+            {k: v for k, v in properties.items() if k not in volatile_keys}
+        )
+
+    def get_block_hash(
+        self, blob: Blob, content: Dict[str, Any], children_hash: Optional[str]
+    ) -> str:
+        # links to other pages render with the slug they resolved to
+        page_refs = [
+            t.page_ref
+            for text in [blob.rich_text, *(blob.table_cells or [])]
+            for t in text
+        ]
+        return get_content_hash(
+            blob.type, normalize_block_content(content), page_refs, children_hash
+        )
+
+
+class TableDataFormat(StrEnum):
+    CSV = "csv"
+    JSON = "json"
+
+
+class TableDataWriter(object):
+    """Streams table rows (cell texts) to a csv or json (list of rows) file."""
+
+    def __init__(self, path: str, data_format: str):
+        self.data_format = TableDataFormat(data_format)
+        self.fp = open(path, "w", newline="")
+        self.num_rows = 0
+        if self.data_format == TableDataFormat.CSV:
+            self.csv_writer = csv.writer(self.fp)
+        else:
+            self.fp.write("[")
+
+    def write_rows(self, rows: List[Blob]) -> None:
+        for row in rows:
+            cells = [
+                "".join(t.plain_text or "" for t in cell)
+                for cell in row.table_cells or []
+            ]
+            if self.data_format == TableDataFormat.CSV:
+                self.csv_writer.writerow(cells)
+            else:
+                self.fp.write(("," if self.num_rows else "") + "\n")
+                self.fp.write(json.dumps(cells))
+            self.num_rows += 1
+
+    def close(self) -> None:
+        if self.data_format == TableDataFormat.JSON:
+            self.fp.write("\n]\n")
+        self.fp.close()
+
+
+class PriorityPolicy(StrEnum):
+    NONE = "none"  # default, db order
+    LAST_EDITED_TIME = "last_edited_time"  # most recently edited first
+    PROPERTY = "property"  # ranked by priority_property_key
+
 
 @dataclass(frozen=True)
 class NotionProviderConfig(BaseProviderConfig):
     database_id: str = field(default=NOTION_DATABASE_ID)
     filter: Dict[str, Any] = field(default_factory=dict)
+    # order in which pages are fetched and published
+    priority_policy: str = PriorityPolicy.NONE
+    # select/status/number property used by the "property" policy
+    priority_property_key: Optional[str] = None
+    # ranked select/status values, highest priority first; if empty
+    # the property is expected to be a number, highest first
+    priority_values: List[str] = field(default_factory=list)
+    # max pages fetched concurrently
+    max_concurrent_pages: int = 8
+    # bounds for the adaptive limit on in-flight block requests
+    min_concurrent_requests: int = 1
+    initial_concurrent_requests: int = 4
+    max_concurrent_requests: int = 32
+    # stop publishing once the run takes longer than this
+    time_budget_secs: Optional[float] = None
+    # rewrite links between pages of the db to hugo relrefs, resolved with
+    # the same post_name_property_key as the exporter's
+    rewrite_page_links: bool = False
+    post_name_property_key: Optional[str] = None
+    # persist the page id -> post slug index between runs
+    page_index_path: Optional[str] = None
+    # tables with more rows are streamed to a data file next to the post
+    table_data_row_threshold: Optional[int] = None
+    table_data_format: str = TableDataFormat.CSV
     tmp_cache_dir: str = field(init=False)
 
     def __post_init__(
         self,
     ):
         assert self.database_id, f"database_id={self.database_id} not valid."
+        PriorityPolicy(self.priority_policy)
+        TableDataFormat(self.table_data_format)
+        assert (
+            self.priority_policy != PriorityPolicy.PROPERTY
+            or self.priority_property_key
+        ), "priority_property_key expected for the 'property' priority policy."
+        assert (
+            self.max_concurrent_pages >= 1
+        ), f"max_concurrent_pages={self.max_concurrent_pages} not valid."
+        assert (
+            1
+            <= self.min_concurrent_requests
+            <= self.initial_concurrent_requests
+            <= self.max_concurrent_requests
+        ), "Expected min <= initial <= max concurrent requests."
+        os.makedirs(f"/tmp/{__package__}", exist_ok=True)
         tmp_cache_dir = tempfile.mkdtemp(prefix="images_", dir=f"/tmp/{__package__}")
         object.__setattr__(self, "tmp_cache_dir", tmp_cache_dir)
 
@@ -194,12 +508,40 @@ class NotionProvider(BaseProvider):
         super(NotionProvider, self).__init__(config)
         self.config: NotionProviderConfig = config
         self.client = AsyncClient(auth=NOTION_TOKEN)
+        self.parser = NotionParser(self.config.tmp_cache_dir)
+        # adapts in-flight block requests to observed latency and throttling
+        self.limiter = AdaptiveConcurrencyLimiter(
+            AdaptiveLimiterConfig(
+                initial_limit=self.config.initial_concurrent_requests,
+                min_limit=self.config.min_concurrent_requests,
+                max_limit=self.config.max_concurrent_requests,
+            ),
+            get_retry_after,
+        )
+        # per-run caches for content shared across pages
+        self.block_children_cache: SingleFlightCache[List[Blob]] = SingleFlightCache()
+        self.link_target_cache: SingleFlightCache[Dict[str, Any]] = SingleFlightCache()
+        # all the pages in the source, once known
+        self.page_ids: Optional[Set[str]] = None
 
-    async def async_fetch_pages_from_db(self) -> List[NotionPageMetadata]:
-        # fetch all available pages (metadata) from db
+    async def async_fetch_db_schema(self) -> Dict[str, Any]:
+        # fetch the db property schema once per run
+        database = await self.client.databases.retrieve(
+            database_id=self.config.database_id
+        )
+        return database["properties"]
+
+    async def async_fetch_pages_from_db(
+        self, database_id: Optional[str] = None
+    ) -> List[NotionPageMetadata]:
+        # fetch all available pages (metadata) from db, defaults to the
+        # configured db and filter
+        query = (
+            asdict(self.config) if database_id is None else {"database_id": database_id}
+        )
         page_metadatas: List[NotionPageMetadata] = []
         async for responses in async_iterate_paginated_api(
-            self.client.databases.query, **asdict(self.config)
+            partial(self.limiter.async_call, self.client.databases.query), **query
         ):
             for resp in responses:
                 assert isinstance(resp, dict), resp
@@ -207,43 +549,287 @@ class NotionProvider(BaseProvider):
                     page_metadatas.append(NotionPageMetadata.init(**resp))
         return page_metadatas
 
-    async def async_fetch_block_content(self, block_id: str) -> List[NotionBlockData]:
-        block_data: List[NotionBlockData] = []
+    async def async_fetch_block_content(self, block_id: str) -> List[Blob]:
+        blobs: List[Blob] = []
+        async for page_blobs in self.async_iterate_block_pages(block_id):
+            blobs.extend(page_blobs)
+        return blobs
+
+    async def async_iterate_block_pages(
+        self, block_id: str
+    ) -> AsyncIterator[List[Blob]]:
+        # each block is parsed as soon as its children are available and its
+        # raw json is dropped right after, so that peak memory scales with
+        # the tree depth rather than the page size
         async for blocks in async_iterate_paginated_api(
-            self.client.blocks.children.list,
+            partial(self.limiter.async_call, self.client.blocks.children.list),
             block_id=block_id,
             page_size=100,
         ):
-            for block in blocks:
-                if block["has_children"]:
-                    # fetch block content recursively
-                    children_block_data = await self.async_fetch_block_content(
-                        block["id"]
+            blobs: List[Blob] = []
+            blocks.reverse()
+            while blocks:
+                block = blocks.pop()
+                data_file = children_hash = None
+                block_type = BlobType(block["type"])
+                content = block[block["type"]]
+                if block_type in (BlobType.CHILD_DATABASE, BlobType.CHILD_PAGE):
+                    # sub pages are linked to, not inlined
+                    children = None
+                elif block_type == BlobType.SYNCED_BLOCK:
+                    # original and duplicates share the content of the source
+                    source_id = (content.get("synced_from") or {}).get(
+                        "block_id", block["id"]
                     )
+                    children = await self.async_fetch_shared_block_content(source_id)
+                elif (
+                    block_type == BlobType.TABLE
+                    and self.config.table_data_row_threshold
+                ):
+                    (
+                        children,
+                        data_file,
+                        children_hash,
+                    ) = await self.async_fetch_table_rows(block["id"])
+                    if data_file:
+                        # rendered through a data file of the configured format
+                        children_hash = get_content_hash(
+                            children_hash, self.config.table_data_format
+                        )
+                elif block_type == BlobType.LINK_TO_PAGE:
+                    content = {**content, **await self.async_fetch_link_target(content)}
+                    children = None
+                elif block["has_children"]:
+                    # fetch block content recursively
+                    children = await self.async_fetch_block_content(block["id"])
                 else:
-                    children_block_data = None
-                assert not block["has_children"] or children_block_data is not None
-                self.logger.debug(pformat(block))
-                block_data.append(
+                    children = None
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug(pformat(block))
+                blob = self.parser.parse_block(
                     NotionBlockData(
                         id=block["id"],
-                        content=block[block["type"]],
-                        type=BlobType(block["type"]),
-                        children=children_block_data,
+                        content=content,
+                        type=block_type,
+                        children=None,
+                    ),
+                    children,
+                )
+                if children is not None:
+                    children_hash = combine_hashes(c.content_hash for c in children)
+                blobs.append(
+                    replace(
+                        blob,
+                        file=data_file or blob.file,
+                        content_hash=self.parser.get_block_hash(
+                            blob, content, children_hash
+                        ),
                     )
                 )
-        return block_data
+                del block, content
+            yield blobs
+
+    async def async_fetch_table_rows(
+        self, table_id: str
+    ) -> Tuple[Optional[List[Blob]], Optional[str], str]:
+        # rows are kept in memory up to the threshold, beyond that they are
+        # streamed to a data file page by page as they are paginated
+        threshold = self.config.table_data_row_threshold
+        assert threshold
+        rows: List[Blob] = []
+        writer: Optional[TableDataWriter] = None
+        data_file = None
+        # same as combine_hashes over all rows, without keeping them around
+        rows_hasher = hashlib.sha256()
+        async for page_rows in self.async_iterate_block_pages(table_id):
+            for row in page_rows:
+                rows_hasher.update((row.content_hash or "").encode())
+            rows.extend(page_rows)
+            if writer is None and len(rows) > threshold:
+                data_file = os.path.join(
+                    self.config.tmp_cache_dir,
+                    f"table_{table_id}.{self.config.table_data_format}",
+                )
+                writer = TableDataWriter(data_file, self.config.table_data_format)
+            if writer:
+                writer.write_rows(rows)
+                rows = []
+        if writer is None:
+            return rows, None, rows_hasher.hexdigest()
+        writer.close()
+        self.logger.debug(f"Exported {writer.num_rows} table rows to {data_file}")
+        return None, data_file, rows_hasher.hexdigest()
+
+    async def async_fetch_shared_block_content(self, block_id: str) -> List[Blob]:
+        # fetched and parsed exactly once per run, however many pages
+        # reference it
+        async def async_fetch() -> List[Blob]:
+            try:
+                return await self.async_fetch_block_content(block_id)
+            except APIResponseError as e:
+                # source not shared with the integration, eg, synced from
+                # another workspace, rendered empty rather than failing
+                # every page referencing it
+                self.logger.warning(f"Unable to fetch synced block {block_id}: {e}")
+                return []
+
+        return await self.block_children_cache.async_get(block_id, async_fetch)
+
+    async def async_fetch_link_target(self, content: Dict[str, Any]) -> Dict[str, Any]:
+        target_id = content[content["type"]]
+
+        async def async_fetch() -> Dict[str, Any]:
+            try:
+                if content["type"] == "database_id":
+                    target = await self.limiter.async_call(
+                        self.client.databases.retrieve, database_id=target_id
+                    )
+                    title = target["title"]
+                else:
+                    target = await self.limiter.async_call(
+                        self.client.pages.retrieve, page_id=target_id
+                    )
+                    title = next(
+                        (
+                            v["title"]
+                            for v in target["properties"].values()
+                            if v["type"] == "title"
+                        ),
+                        [],
+                    )
+            except APIResponseError as e:
+                self.logger.warning(f"Unable to fetch link target {target_id}: {e}")
+                url = get_notion_url(target_id)
+                return {"title": url, "url": url}
+            return {
+                "title": "".join(t["plain_text"] for t in title),
+                "url": target["url"],
+            }
+
+        return await self.link_target_cache.async_get(target_id, async_fetch)
 
     async def async_fetch_and_parse_page_content(
         self, metadata: NotionPageMetadata
     ) -> PageContent:
-        parser = NotionParser(self.config.tmp_cache_dir)
         # fetch and parse page content
-        block_data = await self.async_fetch_block_content(metadata.id)
-        blobs = list(map(parser.parse_block, block_data))
-        properties = parser.parse_properties(metadata.properties)
+        blobs = await self.async_fetch_block_content(metadata.id)
+        properties = self.parser.parse_properties(metadata.properties)
+
+        return PageContent(
+            id=metadata.id,
+            blobs=blobs,
+            properties=properties,
+            content_hash=combine_hashes(
+                [
+                    self.parser.get_properties_hash(properties),
+                    combine_hashes(blob.content_hash for blob in blobs),
+                ]
+            ),
+        )
+
+    def load_page_index(self) -> Dict[str, List[str]]:
+        # (last_edited_time, post path) by page id from the previous run
+        key = self.config.post_name_property_key
+        if self.config.page_index_path and os.path.exists(self.config.page_index_path):
+            with open(self.config.page_index_path) as fp:
+                prev_index = json.load(fp)
+            if prev_index.get("post_name_property_key") == key:
+                return prev_index["pages"]
+        return {}
+
+    def save_page_index(self, pages: Dict[str, List[str]]) -> None:
+        if self.config.page_index_path:
+            with open(self.config.page_index_path, "w") as fp:
+                json.dump(
+                    {
+                        "post_name_property_key": self.config.post_name_property_key,
+                        "pages": pages,
+                    },
+                    fp,
+                )
+
+    def build_page_index(
+        self, page_metadatas: List[NotionPageMetadata]
+    ) -> Dict[str, str]:
+        key = self.config.post_name_property_key
+        prev_pages = self.load_page_index()
+
+        extractors = [
+            e
+            for e in self.parser.property_extractors or []
+            if key in (e.key, e.output_key)
+        ]
+        pages: Dict[str, List[str]] = {}
+        num_reused = 0
+        for metadata in page_metadatas:
+            page_id = normalize_page_id(metadata.id)
+            prev = prev_pages.get(page_id)
+            if prev and prev[0] == metadata.last_edited_time:
+                num_reused += 1
+                pages[page_id] = prev
+                continue
+            properties = (
+                self.parser.parse_properties(metadata.properties, extractors)
+                if key
+                else {}
+            )
+            pages[page_id] = [
+                metadata.last_edited_time,
+                get_post_slug(metadata.id, properties, key),
+            ]
+        self.logger.info(
+            f"Page index has {len(pages)} pages, {num_reused} unchanged since last run"
+        )
+
+        self.save_page_index(pages)
+        return {page_id: slug for page_id, (_, slug) in pages.items()}
+
+    def prioritize_pages(
+        self, page_metadatas: List[NotionPageMetadata]
+    ) -> List[NotionPageMetadata]:
+        if self.config.priority_policy == PriorityPolicy.LAST_EDITED_TIME:
+            # ISO 8601 timestamps sort lexicographically
+            return sorted(
+                page_metadatas, key=lambda m: m.last_edited_time, reverse=True
+            )
+        if self.config.priority_policy != PriorityPolicy.PROPERTY:
+            return page_metadatas
+
+        key = self.config.priority_property_key
+        extractors = [
+            e
+            for e in self.parser.property_extractors or []
+            if key in (e.key, e.output_key)
+        ]
+        assert extractors, f"{key} not a valid priority property"
+        ranks = {v: i for i, v in enumerate(self.config.priority_values)}
+
+        def rank(metadata: NotionPageMetadata) -> float:
+            value = self.parser.parse_properties(metadata.properties, extractors).get(
+                extractors[0].output_key
+            )
+            if ranks:
+                return ranks.get(value, len(ranks))  # type: ignore[arg-type]
+            # highest number first, pages without a value last
+            return -value if isinstance(value, (int, float)) else float("inf")
+
+        return sorted(page_metadatas, key=rank)
 
-        return PageContent(id=metadata.id, blobs=blobs, properties=properties)
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "concurrency": self.limiter.summary(),
+            "shared_blocks": {
+                "fetched": len(self.block_children_cache),
+                "reused": self.block_children_cache.hits,
+            },
+            "link_targets": {
+                "fetched": len(self.link_target_cache),
+                "reused": self.link_target_cache.hits,
+            },
+        }
+
+    def get_page_ids(self) -> Optional[Set[str]]:
+        return self.page_ids
 
     def cleanup(self):
         if os.path.exists(self.config.tmp_cache_dir):
@@ -253,17 +839,286 @@ class NotionProvider(BaseProvider):
         )
 
     async def async_iterate(self) -> AsyncIterator[PageContent]:
+        deadline = (
+            time.monotonic() + self.config.time_budget_secs
+            if self.config.time_budget_secs
+            else None
+        )
         self.logger.info("Querying Notion db")
+        self.parser.set_schema(await self.async_fetch_db_schema())
         page_metadatas = await self.async_fetch_pages_from_db()
         self.logger.info(f"Notion db returned {len(page_metadatas)} pages.")
+        self.page_ids = {metadata.id for metadata in page_metadatas}
+        if self.config.rewrite_page_links:
+            self.parser.page_index = self.build_page_index(page_metadatas)
+        page_metadatas = self.prioritize_pages(page_metadatas)
+
+        # semaphore waiters are woken up in fifo order, so pages are fetched
+        # in priority order with a bounded fan-out
+        semaphore = asyncio.Semaphore(self.config.max_concurrent_pages)
+
+        async def async_fetch_page(metadata: NotionPageMetadata) -> PageContent:
+            async with semaphore:
+                return await self.async_fetch_and_parse_page_content(metadata)
+
+        tasks = [
+            asyncio.create_task(async_fetch_page(metadata))
+            for metadata in page_metadatas
+        ]
+        priority = {task: i for i, task in enumerate(tasks)}
+        pending = set(tasks)
+        try:
+            while pending:
+                timeout = None if deadline is None else deadline - time.monotonic()
+                if timeout is not None and timeout <= 0:
+                    break
+                done, pending = await asyncio.wait(
+                    pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in sorted(done, key=priority.__getitem__):
+                    if deadline is not None and time.monotonic() >= deadline:
+                        # put it back so that it is reported as skipped
+                        pending.add(task)
+                        continue
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        if pending:
+            self.logger.warning(
+                f"Time budget of {self.config.time_budget_secs}s exhausted, "
+                f"skipped {len(pending)} of {len(tasks)} pages."
+            )
+        else:
+            self.logger.info("Completed retrieving all pages from db.")
 
-        for page in asyncio.as_completed(
-            [
-                self.async_fetch_and_parse_page_content(metadata)
-                for metadata in page_metadatas
+
+@dataclass(frozen=True)
+class NotionPageTreeProviderConfig(NotionProviderConfig):
+    # page the crawl starts from, nested pages and dbs are exported under it
+    root_page_id: str = ""
+
+    def __post_init__(self):
+        super(NotionPageTreeProviderConfig, self).__post_init__()
+        assert self.root_page_id, f"root_page_id={self.root_page_id} not valid."
+
+
+@dataclass(frozen=True)
+class CrawlItem:
+    page_id: str
+    section: Tuple[str, ...]
+    metadata: Optional[NotionPageMetadata] = None
+
+
+@register_handler(NotionPageTreeProviderConfig)
+class NotionPageTreeProvider(NotionProvider):
+    """Crawls a tree of nested pages and child dbs starting from a root page.
+    Pages with nested pages are exported as hugo sections."""
+
+    def __init__(self, config: NotionPageTreeProviderConfig):
+        super(NotionPageTreeProvider, self).__init__(config)
+        self.config: NotionPageTreeProviderConfig = config
+        # compiled once per parent db, pages in a db share the schema
+        self.db_property_extractors: Dict[str, List[PropertyExtractor]] = {}
+        self.num_unreachable_dbs = 0
+        # (last_edited_time, post path) by page id, for rewriting links
+        self.crawl_index: Dict[str, List[str]] = {}
+
+    def get_property_extractors(
+        self, metadata: NotionPageMetadata
+    ) -> List[PropertyExtractor]:
+        parent_id = metadata.parent.get("database_id")
+        if not parent_id:
+            return self.parser.compile_property_extractors(metadata.properties)
+        if parent_id not in self.db_property_extractors:
+            self.db_property_extractors[
+                parent_id
+            ] = self.parser.compile_property_extractors(metadata.properties)
+        return self.db_property_extractors[parent_id]
+
+    def get_post_path(
+        self, metadata: NotionPageMetadata, section: Tuple[str, ...]
+    ) -> Tuple[str, ...]:
+        # path of the post, as exported under its parent sections
+        properties = self.parser.parse_properties(
+            metadata.properties, self.get_property_extractors(metadata)
+        )
+        return (
+            *section,
+            get_post_slug(metadata.id, properties, self.config.post_name_property_key),
+        )
+
+    def index_page(self, metadata: NotionPageMetadata, post_path: str) -> None:
+        if self.config.rewrite_page_links:
+            page_id = normalize_page_id(metadata.id)
+            self.crawl_index[page_id] = [metadata.last_edited_time, post_path]
+            self.parser.page_index[page_id] = post_path
+
+    def iterate_child_refs(self, blobs: Optional[List[Blob]]) -> Iterator[Blob]:
+        for blob in blobs or []:
+            if blob.type in (BlobType.CHILD_DATABASE, BlobType.CHILD_PAGE):
+                yield blob
+            else:
+                yield from self.iterate_child_refs(blob.children)
+
+    async def async_crawl_page(
+        self, item: CrawlItem
+    ) -> Tuple[PageContent, List[CrawlItem]]:
+        metadata = item.metadata or NotionPageMetadata.init(
+            **await self.limiter.async_call(
+                self.client.pages.retrieve, page_id=item.page_id
+            )
+        )
+        blobs = await self.async_fetch_block_content(metadata.id)
+        extractors = self.get_property_extractors(metadata)
+        properties = self.parser.parse_properties(metadata.properties, extractors)
+        child_section = self.get_post_path(metadata, item.section)
+        if item.metadata is None:
+            # the root page, the others are indexed once scheduled
+            self.index_page(metadata, "/".join(child_section))
+
+        async def async_fetch_children(blob: Blob) -> List[CrawlItem]:
+            if blob.type == BlobType.CHILD_PAGE:
+                # fetched on discovery rather than on crawl, so that links to
+                # it are resolved before it is crawled
+                child_metadata = NotionPageMetadata.init(
+                    **await self.limiter.async_call(
+                        self.client.pages.retrieve, page_id=blob.id
+                    )
+                )
+                return [
+                    CrawlItem(
+                        page_id=blob.id, section=child_section, metadata=child_metadata
+                    )
+                ]
+            try:
+                rows = await self.async_fetch_pages_from_db(blob.id)
+            except APIResponseError as e:
+                # eg, linked dbs which aren't shared with the integration
+                self.logger.warning(f"Unable to query child db {blob.id}: {e}")
+                self.num_unreachable_dbs += 1
+                return []
+            return [
+                CrawlItem(page_id=row.id, section=child_section, metadata=row)
+                for row in rows
             ]
-        ):
-            yield await page
 
-        self.logger.info("Completed retrieving all pages from db.")
-        self.cleanup()
+        # issued concurrently, bounded by the limiter, in page order
+        children = [
+            child
+            for blob_children in await asyncio.gather(
+                *[async_fetch_children(blob) for blob in self.iterate_child_refs(blobs)]
+            )
+            for child in blob_children
+        ]
+
+        return (
+            PageContent(
+                id=metadata.id,
+                blobs=blobs,
+                properties=properties,
+                section=item.section,
+                content_hash=combine_hashes(
+                    [
+                        self.parser.get_properties_hash(properties, extractors),
+                        combine_hashes(blob.content_hash for blob in blobs),
+                        get_content_hash(item.section),
+                    ]
+                ),
+            ),
+            children,
+        )
+
+    async def async_iterate(self) -> AsyncIterator[PageContent]:
+        deadline = (
+            time.monotonic() + self.config.time_budget_secs
+            if self.config.time_budget_secs
+            else None
+        )
+        self.logger.info(f"Crawling Notion pages from {self.config.root_page_id}")
+        if self.config.rewrite_page_links:
+            # pages not discovered yet are linked to with their previous path
+            self.crawl_index = self.load_page_index()
+            self.parser.page_index = {
+                page_id: post_path
+                for page_id, (_, post_path) in self.crawl_index.items()
+            }
+        # semaphore waiters are woken up in fifo order, so the crawl is
+        # breadth first with a bounded fan-out
+        semaphore = asyncio.Semaphore(self.config.max_concurrent_pages)
+
+        async def async_crawl(
+            item: CrawlItem,
+        ) -> Tuple[PageContent, List[CrawlItem]]:
+            async with semaphore:
+                return await self.async_crawl_page(item)
+
+        visited: Set[str] = set()
+        crawled_page_ids: Set[str] = set()
+        pending: Set[asyncio.Task] = set()
+
+        def schedule(item: CrawlItem) -> bool:
+            page_id = normalize_page_id(item.page_id)
+            if page_id in visited:
+                return False
+            visited.add(page_id)
+            if item.metadata:
+                # indexed by whichever parent schedules it first
+                self.index_page(
+                    item.metadata,
+                    "/".join(self.get_post_path(item.metadata, item.section)),
+                )
+            pending.add(asyncio.create_task(async_crawl(item)))
+            return True
+
+        schedule(CrawlItem(page_id=self.config.root_page_id, section=()))
+        try:
+            while pending:
+                timeout = None if deadline is None else deadline - time.monotonic()
+                if timeout is not None and timeout <= 0:
+                    break
+                done, pending = await asyncio.wait(
+                    pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    page_content, children = task.result()
+                    crawled_page_ids.add(page_content.id)
+                    # nested pages are crawled as soon as their parent is
+                    num_scheduled = sum([schedule(child) for child in children])
+                    is_section = num_scheduled > 0
+                    # links to the pages indexed since the page was parsed
+                    blobs = self.parser.resolve_page_refs(page_content.blobs) or []
+                    page_refs = [
+                        text.page_ref
+                        for blob in blobs
+                        for text in iterate_blob_texts(blob)
+                        if text.page_ref
+                    ]
+                    yield replace(
+                        page_content,
+                        blobs=blobs,
+                        is_section=is_section,
+                        # exported as _index.md rather than index.md
+                        content_hash=get_content_hash(
+                            page_content.content_hash, is_section, page_refs
+                        ),
+                    )
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        if pending:
+            self.logger.warning(
+                f"Time budget of {self.config.time_budget_secs}s exhausted, "
+                f"skipped {len(pending)} of {len(visited)} pages found so far."
+            )
+        else:
+            self.logger.info(f"Completed crawling {len(visited)} pages.")
+        if not pending and not self.num_unreachable_dbs:
+            # pages of a partial crawl aren't known to be all the pages
+            self.page_ids = crawled_page_ids
+        if self.config.rewrite_page_links:
+            self.save_page_index(self.crawl_index)
@@ -1,9 +1,15 @@
 #!/usr/bin/env python3
 
 import asyncio
+import json
 import logging
-from dataclasses import dataclass
+import os
+import time
+from dataclasses import asdict, dataclass
+from pprint import pformat
+from typing import AsyncIterator, Dict, List, Optional
 
+from notion2hugo import __version__
 from notion2hugo.base import (
     BaseExporter,
     BaseExporterConfig,
@@ -11,9 +17,10 @@ from notion2hugo.base import (
     BaseFormatterConfig,
     BaseProvider,
     BaseProviderConfig,
+    PageContent,
 )
 from notion2hugo.registry import Factory
-from notion2hugo.utils import get_logger
+from notion2hugo.utils import combine_hashes, get_content_hash, get_logger
 
 
 @dataclass(frozen=True)
@@ -21,31 +28,154 @@ class RunnerConfig:
     provider_config: BaseProviderConfig
     formatter_config: BaseFormatterConfig
     exporter_config: BaseExporterConfig
+    # max pages handed to the formatter and exporter at once
+    batch_size: int = 1
+    # flush a partial batch once its first page waited this long
+    batch_timeout_secs: Optional[float] = None
+    # persist the page id -> content hash of exported pages between runs,
+    # pages whose content and settings didn't change since, and whose output
+    # is still there, are neither formatted nor exported again
+    content_hash_path: Optional[str] = None
+
+    def __post_init__(self):
+        assert self.batch_size >= 1, f"batch_size={self.batch_size} not valid."
+        assert (
+            self.batch_timeout_secs is None or self.batch_timeout_secs > 0
+        ), f"batch_timeout_secs={self.batch_timeout_secs} not valid."
+        # links are resolved by the provider to the slug the exporter names
+        # the post dirs with
+        if getattr(self.provider_config, "rewrite_page_links", False):
+            provider_key = getattr(self.provider_config, "post_name_property_key")
+            exporter_key = getattr(self.exporter_config, "post_name_property_key", None)
+            assert provider_key == exporter_key, (
+                f"provider post_name_property_key={provider_key} expected to "
+                f"match the exporter's {exporter_key} to rewrite page links."
+            )
+        # unchanged pages are skipped, their previous output has to be kept
+        assert not self.content_hash_path or not getattr(
+            self.exporter_config, "clean_parent_dir", False
+        ), "content_hash_path expects the exporter's clean_parent_dir = false."
 
 
 class Runner(object):
     def __init__(self, config: RunnerConfig):
         self.logger = get_logger(__package__, logging.INFO)
+        self.config = config
 
         self.provider = Factory.build_handler(config.provider_config)
         self.formatter = Factory.build_handler(config.formatter_config)
         self.exporter = Factory.build_handler(config.exporter_config)
 
+    async def async_iterate_batches(
+        self, pages: AsyncIterator[PageContent]
+    ) -> AsyncIterator[List[PageContent]]:
+        batch: List[PageContent] = []
+        deadline: Optional[float] = None
+        next_page = asyncio.ensure_future(anext(pages))
+        while True:
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            done, _ = await asyncio.wait({next_page}, timeout=timeout)
+            if not done:
+                # batch window elapsed, keep waiting on the same page afterwards
+                yield batch
+                batch, deadline = [], None
+                continue
+            try:
+                page_content = next_page.result()
+            except StopAsyncIteration:
+                break
+            self.logger.info(f"Got 1 page from provider, id = {page_content.id}")
+            batch.append(page_content)
+            if deadline is None and self.config.batch_timeout_secs:
+                deadline = time.monotonic() + self.config.batch_timeout_secs
+            if len(batch) >= self.config.batch_size:
+                yield batch
+                batch, deadline = [], None
+            next_page = asyncio.ensure_future(anext(pages))
+        if batch:
+            yield batch
+
+    def load_content_hashes(self) -> Dict[str, str]:
+        path = self.config.content_hash_path
+        if not path or not os.path.exists(path):
+            return {}
+        with open(path) as fp:
+            return json.load(fp)
+
+    def save_content_hashes(self, content_hashes: Dict[str, str]) -> None:
+        if not self.config.content_hash_path:
+            return
+        with open(self.config.content_hash_path, "w") as fp:
+            json.dump(content_hashes, fp, indent=2, sort_keys=True)
+
+    def get_settings_hash(self) -> str:
+        # changing how pages are formatted or exported changes every post,
+        # the provider settings are reflected in the page content hashes
+        return get_content_hash(
+            __version__,
+            *[
+                (type(config).__qualname__, asdict(config))
+                for config in [
+                    self.config.formatter_config,
+                    self.config.exporter_config,
+                ]
+            ],
+        )
+
     async def async_run(self) -> None:
         assert isinstance(self.provider, BaseProvider)
         assert isinstance(self.formatter, BaseFormatter)
         assert isinstance(self.exporter, BaseExporter)
 
-        self.logger.info(f"Processing {type(self.provider).__qualname__}.")
-        async for page_content in self.provider.async_iterate():
-            self.logger.info(f"Got 1 page from provider, id = {page_content.id}")
+        start = time.monotonic()
+        num_pages = num_unchanged = 0
+        content_hashes = self.load_content_hashes()
+        settings_hash = self.get_settings_hash()
 
+        def get_page_hash(page: PageContent) -> Optional[str]:
+            if page.content_hash is None:
+                return None
+            return combine_hashes([page.content_hash, settings_hash])
+
+        self.logger.info(f"Processing {type(self.provider).__qualname__}.")
+        async for pages in self.async_iterate_batches(self.provider.async_iterate()):
+            batch = [
+                page
+                for page in pages
+                if get_page_hash(page) is None
+                or content_hashes.get(page.id) != get_page_hash(page)
+                or not self.exporter.has_output(page)
+            ]
+            num_unchanged += len(pages) - len(batch)
+            if not batch:
+                self.logger.info(f"Skipped {len(pages)} unchanged pages.")
+                continue
             self.logger.info(f"Processing {type(self.formatter).__qualname__}.")
-            formatted_post = await self.formatter.async_process(page_content)
+            formatted_posts = await self.formatter.async_process_batch(batch)
 
             self.logger.info(f"Processing {type(self.exporter).__qualname__}.")
-            await self.exporter.async_process(formatted_post)
+            await self.exporter.async_process_batch(formatted_posts)
+            num_pages += len(batch)
+            for page in batch:
+                page_hash = get_page_hash(page)
+                if page_hash is not None:
+                    content_hashes[page.id] = page_hash
+        page_ids = self.provider.get_page_ids()
+        if page_ids is not None:
+            await self.exporter.async_prune(page_ids)
+            content_hashes = {k: v for k, v in content_hashes.items() if k in page_ids}
+        # exported again by the next run, whether they change or not
+        for page_id in await self.exporter.async_finalize():
+            content_hashes.pop(page_id, None)
+        self.formatter.cleanup()
+        self.provider.cleanup()
+        self.save_content_hashes(content_hashes)
         self.logger.info("All pages processed.")
+        self.logger.info(
+            f"Run summary: pages = {num_pages}, unchanged = {num_unchanged}, "
+            f"elapsed = {time.monotonic() - start:.2f}s, "
+            f"provider = {pformat(self.provider.summary())}"
+        )
 
     def run(self) -> None:
         asyncio.run(self.async_run())
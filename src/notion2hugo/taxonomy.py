@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+
+"""Incremental index of taxonomy terms per post, kept in a local sqlite db.
+
+It is used to precompute Hugo data files, so that Hugo doesn't have to
+derive them across all posts on every build:
+- {data_dir}/taxonomies/{taxonomy}/{term slug}-{sha1[:8]}.json: the term and
+  paths of the posts with it
+- {data_dir}/related/{post path slug}-{sha1[:8]}.json: the post path and its
+  top-K related posts, by number of shared terms
+
+Posts are referred to by their path relative to the exporter's parent dir,
+slugs alone are ambiguous across sections. Only the files affected by posts
+whose terms changed in the run are rewritten, along with the ones missing
+from the data dir.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+from typing import Dict, List, Optional, Set, Tuple
+
+from notion2hugo.utils import get_logger, sanitize_path
+
+# (taxonomy, term)
+TTerm = Tuple[str, str]
+
+# bumped on schema changes, the index is rebuilt from scratch then
+_SCHEMA_VERSION = 2
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    page_id TEXT PRIMARY KEY,
+    post_path TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS terms (
+    page_id TEXT NOT NULL,
+    taxonomy TEXT NOT NULL,
+    term TEXT NOT NULL,
+    PRIMARY KEY (page_id, taxonomy, term)
+);
+CREATE INDEX IF NOT EXISTS terms_by_term ON terms (taxonomy, term);
+"""
+
+
+def get_data_file_name(name: str) -> str:
+    # the slug alone collides for names differing only in case, punctuation
+    # or non-ascii chars, eg, terms "C++" and "C", or post paths "a/b" and "ab"
+    digest = hashlib.sha1(name.encode()).hexdigest()[:8]
+    slug = sanitize_path(name.lower().replace(" ", "-").replace("/", "-"))
+    return f"{slug}-{digest}.json" if slug else f"{digest}.json"
+
+
+class TaxonomyIndex(object):
+    def __init__(self, db_path: str):
+        self.logger = get_logger(__package__)
+        self.db = sqlite3.connect(db_path)
+        (version,) = self.db.execute("PRAGMA user_version").fetchone()
+        if version != _SCHEMA_VERSION:
+            # the exporter treats pages missing from the index as not exported
+            self.db.executescript(
+                "DROP TABLE IF EXISTS pages; DROP TABLE IF EXISTS terms;"
+            )
+            self.db.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+        self.db.executescript(_SCHEMA)
+        # changed in this run
+        self.changed_pages: Set[str] = set()
+        self.changed_terms: Set[TTerm] = set()
+        self.removed_post_paths: Set[str] = set()
+
+    def get_terms(self, page_id: str) -> Set[TTerm]:
+        return set(
+            self.db.execute(
+                "SELECT taxonomy, term FROM terms WHERE page_id = ?", (page_id,)
+            )
+        )
+
+    def update_page(self, page_id: str, post_path: str, terms: Set[TTerm]) -> bool:
+        prev_post_path = self.get_post_path(page_id)
+        prev_terms = self.get_terms(page_id)
+        if prev_post_path == post_path and prev_terms == terms:
+            return False
+
+        self.changed_pages.add(page_id)
+        if prev_post_path != post_path:
+            # every term listing the post refers to it by path
+            self.changed_terms |= prev_terms | terms
+            if prev_post_path:
+                self.removed_post_paths.add(prev_post_path)
+        else:
+            self.changed_terms |= prev_terms ^ terms
+        self.db.execute(
+            "INSERT OR REPLACE INTO pages (page_id, post_path) VALUES (?, ?)",
+            (page_id, post_path),
+        )
+        self.db.execute("DELETE FROM terms WHERE page_id = ?", (page_id,))
+        self.db.executemany(
+            "INSERT INTO terms (page_id, taxonomy, term) VALUES (?, ?, ?)",
+            [(page_id, taxonomy, term) for taxonomy, term in terms],
+        )
+        return True
+
+    def get_page_ids(self) -> Set[str]:
+        return {page_id for (page_id,) in self.db.execute("SELECT page_id FROM pages")}
+
+    def has_page(self, page_id: str) -> bool:
+        return self.get_post_path(page_id) is not None
+
+    def remove_page(self, page_id: str) -> None:
+        post_path = self.get_post_path(page_id)
+        if post_path is None:
+            return
+        self.changed_terms |= self.get_terms(page_id)
+        self.removed_post_paths.add(post_path)
+        self.changed_pages.discard(page_id)
+        self.db.execute("DELETE FROM pages WHERE page_id = ?", (page_id,))
+        self.db.execute("DELETE FROM terms WHERE page_id = ?", (page_id,))
+
+    def get_affected_pages(self) -> Set[str]:
+        # pages sharing a changed term have their related posts changed too
+        affected = set(self.changed_pages)
+        for taxonomy, term in self.changed_terms:
+            affected.update(
+                page_id
+                for (page_id,) in self.db.execute(
+                    "SELECT page_id FROM terms WHERE taxonomy = ? AND term = ?",
+                    (taxonomy, term),
+                )
+            )
+        return affected
+
+    def get_all_terms(self) -> Set[TTerm]:
+        return set(self.db.execute("SELECT DISTINCT taxonomy, term FROM terms"))
+
+    def get_term_post_paths(self, taxonomy: str, term: str) -> List[str]:
+        return [
+            post_path
+            for (post_path,) in self.db.execute(
+                "SELECT p.post_path FROM terms t "
+                "JOIN pages p ON p.page_id = t.page_id "
+                "WHERE t.taxonomy = ? AND t.term = ? ORDER BY p.post_path",
+                (taxonomy, term),
+            )
+        ]
+
+    def get_related(self, page_id: str, top_k: int) -> List[Dict[str, object]]:
+        return [
+            {"path": post_path, "score": score}
+            for post_path, score in self.db.execute(
+                "SELECT p.post_path, COUNT(*) AS score FROM terms a "
+                "JOIN terms b ON a.taxonomy = b.taxonomy AND a.term = b.term "
+                "AND a.page_id != b.page_id "
+                "JOIN pages p ON p.page_id = b.page_id "
+                "WHERE a.page_id = ? GROUP BY p.post_path "
+                "ORDER BY score DESC, p.post_path LIMIT ?",
+                (page_id, top_k),
+            )
+        ]
+
+    def get_post_path(self, page_id: str) -> Optional[str]:
+        row = self.db.execute(
+            "SELECT post_path FROM pages WHERE page_id = ?", (page_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def get_term_path(self, data_dir: str, taxonomy: str, term: str) -> str:
+        return os.path.join(
+            data_dir,
+            "taxonomies",
+            sanitize_path(taxonomy.lower()),
+            get_data_file_name(term),
+        )
+
+    def get_related_path(self, data_dir: str, post_path: str) -> str:
+        return os.path.join(data_dir, "related", get_data_file_name(post_path))
+
+    def write_json(self, path: str, data: object) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as fp:
+            json.dump(data, fp, indent=2)
+
+    def remove(self, path: str) -> None:
+        if os.path.exists(path):
+            os.remove(path)
+
+    def get_missing_data(self, data_dir: str) -> Tuple[Set[TTerm], Set[str]]:
+        # data files wiped since they were written, eg, a fresh data dir
+        terms = {
+            (taxonomy, term)
+            for taxonomy, term in self.get_all_terms()
+            if not os.path.exists(self.get_term_path(data_dir, taxonomy, term))
+        }
+        page_ids = {
+            page_id
+            for page_id, post_path in self.db.execute(
+                "SELECT page_id, post_path FROM pages"
+            )
+            if not os.path.exists(self.get_related_path(data_dir, post_path))
+        }
+        return terms, page_ids
+
+    def write_data_files(self, data_dir: str, top_k: int) -> None:
+        missing_terms, missing_pages = self.get_missing_data(data_dir)
+        affected_pages = self.get_affected_pages()
+        missing_terms -= self.changed_terms
+        missing_pages -= affected_pages
+        changed_terms = self.changed_terms | missing_terms
+        affected_pages |= missing_pages
+        for taxonomy, term in changed_terms:
+            path = self.get_term_path(data_dir, taxonomy, term)
+            post_paths = self.get_term_post_paths(taxonomy, term)
+            if post_paths:
+                self.write_json(path, {"term": term, "pages": post_paths})
+            else:
+                self.remove(path)
+        for post_path in self.removed_post_paths:
+            self.remove(self.get_related_path(data_dir, post_path))
+        for page_id in affected_pages:
+            post_path = self.get_post_path(page_id)
+            assert post_path is not None, f"page {page_id} missing from the index"
+            self.write_json(
+                self.get_related_path(data_dir, post_path),
+                {"path": post_path, "related": self.get_related(page_id, top_k)},
+            )
+        self.db.commit()
+        self.logger.info(
+            f"Updated taxonomy data for {len(changed_terms)} terms "
+            f"({len(missing_terms)} missing) and related posts for "
+            f"{len(affected_pages)} pages ({len(missing_pages)} missing) "
+            f"in '{data_dir}'"
+        )
+        self.changed_pages.clear()
+        self.changed_terms.clear()
+        self.removed_post_paths.clear()
+
+    def close(self) -> None:
+        self.db.close()
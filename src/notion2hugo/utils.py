@@ -1,5 +1,22 @@
+import asyncio
+import hashlib
+import json
 import logging
-from typing import Dict
+import re
+from functools import partial
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Generic,
+    Iterable,
+    Mapping,
+    Optional,
+    TypeVar,
+)
+
+TValue = TypeVar("TValue")
 
 _LOGGER: Dict[str, logging.Logger] = {}
 
@@ -22,3 +39,72 @@ def get_logger(name: str, level: int = logging.INFO) -> logging.Logger:
 
     _LOGGER[name] = logger
     return logger
+
+
+def sanitize_path(name: str) -> str:
+    pattern = re.compile(r"[^a-zA-Z0-9-_\.]")
+    return pattern.sub("", name)
+
+
+def get_post_slug(
+    page_id: str, properties: Mapping[str, Any], post_name_property_key: Optional[str]
+) -> str:
+    # use one of the page properties as post dir name, defaults to page id
+    assert not post_name_property_key or properties.get(post_name_property_key), (
+        f"{post_name_property_key} not a valid " f"property [{properties.keys()}]"
+    )
+    post_dir_name = (
+        properties[post_name_property_key] if post_name_property_key else page_id
+    )
+    assert isinstance(post_dir_name, str), f"{post_dir_name} expected to be str"
+    return sanitize_path(post_dir_name)
+
+
+def get_content_hash(*parts: Any) -> str:
+    # stable across runs and processes, unlike hash()
+    hasher = hashlib.sha256()
+    for part in parts:
+        hasher.update(
+            json.dumps(
+                part, sort_keys=True, separators=(",", ":"), default=str
+            ).encode()
+        )
+    return hasher.hexdigest()
+
+
+def combine_hashes(hashes: Iterable[Optional[str]]) -> str:
+    # order sensitive, can be fed incrementally from a stream of hashes
+    hasher = hashlib.sha256()
+    for h in hashes:
+        hasher.update((h or "").encode())
+    return hasher.hexdigest()
+
+
+class SingleFlightCache(Generic[TValue]):
+    """Per-run cache which runs at most one fetch per key, concurrent callers
+    for the same key await the same in-flight fetch."""
+
+    def __init__(self) -> None:
+        self._futures: Dict[str, asyncio.Future[TValue]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def async_get(
+        self, key: str, fetch: Callable[[], Awaitable[TValue]]
+    ) -> TValue:
+        if key in self._futures:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self._futures[key] = asyncio.ensure_future(fetch())
+            self._futures[key].add_done_callback(partial(self._evict_failed, key))
+        # shielded, cancelling one caller must not cancel the shared fetch
+        return await asyncio.shield(self._futures[key])
+
+    def _evict_failed(self, key: str, future: "asyncio.Future[TValue]") -> None:
+        # callers awaiting it get the error, later ones fetch again
+        if future.cancelled() or future.exception() is not None:
+            self._futures.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._futures)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+import asyncio
+import statistics
+from typing import Optional
+
+import pytest
+
+from notion2hugo.concurrency import AdaptiveConcurrencyLimiter, AdaptiveLimiterConfig
+
+
+class ThrottledError(Exception):
+    pass
+
+
+class SimulatedBackend:
+    """Serves `capacity` requests in parallel at `base_latency`, queues
+    beyond that and throttles above `throttle_at` in-flight requests."""
+
+    def __init__(self, capacity: int, base_latency: float, throttle_at: int):
+        self.capacity = capacity
+        self.base_latency = base_latency
+        self.throttle_at = throttle_at
+        self.in_flight = 0
+
+    async def request(self) -> None:
+        if self.in_flight >= self.throttle_at:
+            raise ThrottledError()
+        self.in_flight += 1
+        try:
+            await asyncio.sleep(
+                self.base_latency * max(1.0, self.in_flight / self.capacity)
+            )
+        finally:
+            self.in_flight -= 1
+
+
+def get_retry_after(e: Exception) -> Optional[float]:
+    return 0.01 if isinstance(e, ThrottledError) else None
+
+
+class TestAdaptiveConcurrencyLimiter:
+    async def run(self, backend: SimulatedBackend) -> AdaptiveConcurrencyLimiter:
+        limiter = AdaptiveConcurrencyLimiter(
+            AdaptiveLimiterConfig(initial_limit=1, max_limit=64), get_retry_after
+        )
+
+        async def worker() -> None:
+            for _ in range(30):
+                await limiter.async_call(backend.request)
+
+        await asyncio.gather(*[worker() for _ in range(64)])
+        return limiter
+
+    @pytest.mark.asyncio
+    async def test_converges_near_capacity(self):
+        limiter = await self.run(
+            SimulatedBackend(capacity=8, base_latency=0.01, throttle_at=64)
+        )
+        limits = [limit for _, limit in limiter.history]
+        assert 4 <= statistics.median(limits[len(limits) // 2 :]) <= 16
+        assert limiter.num_requests == 64 * 30
+
+    @pytest.mark.asyncio
+    async def test_backs_off_when_throttled(self):
+        limiter = await self.run(
+            SimulatedBackend(capacity=32, base_latency=0.01, throttle_at=6)
+        )
+        limits = [limit for _, limit in limiter.history]
+        assert limiter.num_throttled > 0
+        assert statistics.median(limits[len(limits) // 2 :]) <= 8
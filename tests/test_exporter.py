@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+import pytest
+
+from notion2hugo.base import Blob, BlobType, ContentWithAnnotation, PageContent
+from notion2hugo.exporter import MarkdownExporter, MarkdownExporterConfig
+
+
+def make_paragraph(*texts: ContentWithAnnotation) -> Blob:
+    return Blob(
+        id="block",
+        rich_text=list(texts),
+        type=BlobType.PARAGRAPH,
+        children=None,
+        file=None,
+        language=None,
+        table_width=None,
+        table_cells=None,
+        is_checked=None,
+    )
+
+
+def make_link(slug: str) -> ContentWithAnnotation:
+    return ContentWithAnnotation(
+        plain_text=slug, href=f"https://www.notion.so/{slug}", page_ref=slug
+    )
+
+
+class TestMarkdownExporter:
+    @pytest.mark.asyncio
+    async def test_unlink_missing_page_refs(self, tmp_path):
+        exporter = MarkdownExporter(MarkdownExporterConfig(parent_dir=str(tmp_path)))
+        # b is exported, c was skipped, eg, by the provider's time budget
+        await exporter.async_process_batch(
+            [
+                PageContent(
+                    id="a",
+                    blobs=[make_paragraph(make_link("b"), make_link("c"))],
+                    properties={},
+                ),
+                PageContent(id="b", blobs=[], properties={}),
+            ]
+        )
+        await exporter.async_finalize()
+
+        text = (tmp_path / "a" / "index.md").read_text()
+        assert '[b]({{< relref "../b" >}})' in text
+        assert "[c](https://www.notion.so/c)" in text
+
+    @pytest.mark.asyncio
+    async def test_has_output_taxonomy_index(self, tmp_path):
+        def make_exporter(index_name: str) -> MarkdownExporter:
+            return MarkdownExporter(
+                MarkdownExporterConfig(
+                    parent_dir=str(tmp_path / "out"),
+                    taxonomy_keys=["Tags"],
+                    taxonomy_index_path=str(tmp_path / index_name),
+                    data_dir=str(tmp_path / "data"),
+                    clean_parent_dir=False,
+                )
+            )
+
+        page = PageContent(id="a", blobs=[], properties={"Tags": ["x"]})
+        exporter = make_exporter("index.sqlite")
+        await exporter.async_process_batch([page])
+        await exporter.async_finalize()
+        assert make_exporter("index.sqlite").has_output(page)
+        # the terms of the post are missing from a fresh index
+        assert not make_exporter("fresh.sqlite").has_output(page)
+
+    @pytest.mark.asyncio
+    async def test_remove_stale_output(self, tmp_path):
+        async def export(*pages: PageContent, page_ids=None) -> None:
+            exporter = MarkdownExporter(
+                MarkdownExporterConfig(
+                    parent_dir=str(tmp_path),
+                    post_name_property_key="Title",
+                    clean_parent_dir=False,
+                )
+            )
+            await exporter.async_process_batch(list(pages))
+            if page_ids is not None:
+                await exporter.async_prune(page_ids)
+            await exporter.async_finalize()
+
+        def make_page(page_id: str, title: str, **kwargs) -> PageContent:
+            return PageContent(
+                id=page_id, blobs=[], properties={"Title": title}, **kwargs
+            )
+
+        await export(make_page("1", "a"), make_page("2", "b", section=("a",)))
+        # a leaf page which became a section, nested pages are exported later
+        await export(make_page("1", "a", is_section=True))
+        assert (tmp_path / "a" / "_index.md").exists()
+        assert not (tmp_path / "a" / "index.md").exists()
+        assert (tmp_path / "a" / "b" / "index.md").exists()
+
+        # renamed section, along with the pages under it
+        await export(
+            make_page("1", "c", is_section=True), make_page("2", "b", section=("c",))
+        )
+        assert not (tmp_path / "a").exists()
+        assert (tmp_path / "c" / "_index.md").exists()
+        assert (tmp_path / "c" / "b" / "index.md").exists()
+
+        # pages deleted from the source
+        await export(page_ids={"1"})
+        assert not (tmp_path / "c" / "b").exists()
+        assert (tmp_path / "c" / "_index.md").exists()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+import pytest
+
+from notion2hugo.base import Blob, BlobType, ContentWithAnnotation, PageContent
+from notion2hugo.exporter import MarkdownStyler
+from notion2hugo.formatter import HugoFormatter, HugoFormatterConfig
+
+
+def make_code(code: str, language: str) -> Blob:
+    return Blob(
+        id="code",
+        rich_text=[ContentWithAnnotation(plain_text=code)],
+        type=BlobType.CODE,
+        children=None,
+        file=None,
+        language=language,
+        table_width=None,
+        table_cells=None,
+        is_checked=None,
+    )
+
+
+class TestHugoFormatter:
+    @pytest.mark.asyncio
+    async def test_highlight_blank_lines(self, tmp_path):
+        pytest.importorskip("pygments")
+        formatter = HugoFormatter(
+            HugoFormatterConfig(
+                highlight_code=True,
+                highlight_cache_dir=str(tmp_path),
+                highlight_workers=1,
+            )
+        )
+        code = "def f():\n    x = 1\n\n    return x\n"
+        page = PageContent(id="a", blobs=[make_code(code, "python")], properties={})
+        # highlighted, then read back from the cache
+        for _ in range(2):
+            (content,) = await formatter.async_process_batch([page])
+            markdown = MarkdownStyler.process(content.blobs[0]).strip()
+            assert markdown.startswith("<div")
+            # a blank line would end the html block mid snippet
+            assert all(line.strip() for line in markdown.split("\n"))
+            assert "&#10;&#10;" in markdown
+        formatter.cleanup()
+        assert formatter.executor is None
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+from dataclasses import dataclass
+from typing import AsyncIterator
+
+from notion2hugo.__main__ import parse_input_args
+from notion2hugo.base import (
+    BaseProvider,
+    BaseProviderConfig,
+    Blob,
+    BlobType,
+    ContentWithAnnotation,
+    PageContent,
+    register_handler,
+)
+from notion2hugo.exporter import MarkdownExporterConfig
+from notion2hugo.formatter import HugoFormatterConfig
+from notion2hugo.profiler import OTHER_STAGE, ProfilerConfig, RunProfiler
+from notion2hugo.runner import Runner, RunnerConfig
+
+
+@dataclass(frozen=True)
+class ParagraphsProviderConfig(BaseProviderConfig):
+    num_pages: int = 20
+    num_blocks: int = 50
+
+
+@register_handler(ParagraphsProviderConfig)
+class ParagraphsProvider(BaseProvider):
+    def __init__(self, config: ParagraphsProviderConfig):
+        super(ParagraphsProvider, self).__init__(config)
+        self.config = config
+
+    async def async_iterate(self) -> AsyncIterator[PageContent]:
+        for i in range(self.config.num_pages):
+            yield PageContent(
+                id=f"page-{i}",
+                blobs=[
+                    Blob(
+                        id=f"block-{j}",
+                        rich_text=[
+                            ContentWithAnnotation(
+                                plain_text=f"paragraph {j} " * 10, bold=True
+                            )
+                        ],
+                        type=BlobType.PARAGRAPH,
+                        children=None,
+                        file=None,
+                        language=None,
+                        table_width=None,
+                        table_cells=None,
+                        is_checked=None,
+                    )
+                    for j in range(self.config.num_blocks)
+                ],
+                properties={"Title": f"Page {i}"},
+            )
+
+
+class TestRunProfiler:
+    def test_profile_run(self, tmp_path):
+        runner = Runner(
+            RunnerConfig(
+                provider_config=ParagraphsProviderConfig(),
+                formatter_config=HugoFormatterConfig(),
+                exporter_config=MarkdownExporterConfig(
+                    parent_dir=str(tmp_path / "out")
+                ),
+            )
+        )
+        profile_dir = tmp_path / "profile"
+        profiler = RunProfiler(
+            ProfilerConfig(output_dir=str(profile_dir), sample_interval_secs=0.001)
+        )
+        profiler.run(runner)
+
+        for name in ["summary.txt", "cpu.collapsed", "allocations.txt"]:
+            assert (profile_dir / name).read_text(), name
+        # the samples are attributed to the pipeline stages
+        assert set(profiler.cpu_stages) - {OTHER_STAGE}
+        assert "styler" in (profile_dir / "summary.txt").read_text()
+
+    def test_profile_args(self, tmp_path):
+        config_path = tmp_path / "config.toml"
+        config_path.write_text("")
+        args = parse_input_args(["--profile", str(config_path)])
+        assert args.profile and args.config_path.name == str(config_path)
+        args.config_path.close()
+        args = parse_input_args(["--profile-dir", "out", str(config_path)])
+        assert not args.profile and args.profile_dir == "out"
+        args.config_path.close()
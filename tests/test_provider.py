@@ -1,10 +1,35 @@
 #!/usr/bin/env python3
 
 
+import asyncio
+import csv
+import time
+import tracemalloc
+from collections import Counter
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Set
+
+import httpx
 import pytest
+from notion_client.errors import APIErrorCode, APIResponseError
 
 from notion2hugo import NOTION_DATABASE_ID
-from notion2hugo.provider import NotionProvider, NotionProviderConfig
+from notion2hugo.exporter import (
+    MarkdownExporter,
+    MarkdownExporterConfig,
+    MarkdownStyler,
+)
+from notion2hugo.provider import (
+    NotionPageTreeProvider,
+    NotionPageTreeProviderConfig,
+    NotionParser,
+    NotionProvider,
+    NotionProviderConfig,
+    PriorityPolicy,
+    get_page_id_from_url,
+    normalize_block_content,
+)
+from notion2hugo.utils import get_content_hash
 
 
 class TestNotionProvider:
@@ -24,3 +49,584 @@ class TestNotionProvider:
         async for page in provider.async_iterate():
             result.append(page)
         assert len(result) == 3
+
+
+class TestNotionParser:
+    def test_parse_properties(self, tmp_path):
+        schema = {
+            "Name": {"type": "title", "title": {}},
+            "Tags": {"type": "multi_select", "multi_select": {}},
+            "# Status": {"type": "status", "status": {}},
+            "Date": {"type": "date", "date": {}},
+            "Draft": {"type": "checkbox", "checkbox": {}},
+            "ID": {"type": "unique_id", "unique_id": {}},
+            "Related": {"type": "relation", "relation": {}},
+        }
+        page_properties = {
+            "Name": {"type": "title", "title": [{"plain_text": "Hello"}]},
+            "Tags": {"type": "multi_select", "multi_select": [{"name": "a"}]},
+            "# Status": {"type": "status", "status": {"name": "Done"}},
+            "Date": {"type": "date", "date": {"start": "2023-08-01"}},
+            "Draft": {"type": "checkbox", "checkbox": False},
+            "ID": {"type": "unique_id", "unique_id": {"prefix": None, "number": 3}},
+            "Related": {"type": "relation", "relation": [{"id": "abc"}]},
+        }
+        parser = NotionParser(str(tmp_path))
+        parser.set_schema(schema)
+        assert parser.parse_properties(page_properties) == {
+            "Title": "'Hello'",
+            "Tags": ["a"],
+            "# Status": "Done",
+            "Date": "2023-08-01",
+            "Draft": False,
+            "ID": 3,
+        }
+
+    def test_get_page_id_from_url(self):
+        page_id = "2a3b4c5d6e7f8091a2b3c4d5e6f70812"
+        assert get_page_id_from_url(f"/{page_id}") == page_id
+        assert (
+            get_page_id_from_url(f"https://www.notion.so/Post-Title-{page_id}?pvs=4")
+            == page_id
+        )
+        assert (
+            get_page_id_from_url(
+                "https://www.notion.so/2a3b4c5d-6e7f-8091-a2b3-c4d5e6f70812"
+            )
+            == page_id
+        )
+        assert get_page_id_from_url(f"https://example.com/{page_id}") is None
+
+    def test_normalize_block_content(self):
+        def make_image(url: str, expiry_time: str) -> Dict[str, Any]:
+            return {
+                "caption": [],
+                "type": "file",
+                "file": {"url": url, "expiry_time": expiry_time},
+            }
+
+        url = "https://prod-files-secure.s3.us-west-2.amazonaws.com/ws/img/a.png"
+        content_hash = get_content_hash(
+            normalize_block_content(
+                make_image(f"{url}?X-Amz-Signature=1", "2023-08-01T01:00:00.000Z")
+            )
+        )
+        # signed again on the next fetch
+        assert content_hash == get_content_hash(
+            normalize_block_content(
+                make_image(f"{url}?X-Amz-Signature=2", "2023-08-02T01:00:00.000Z")
+            )
+        )
+        # replaced image
+        assert content_hash != get_content_hash(
+            normalize_block_content(
+                make_image(
+                    url.replace("a.png", "b.png") + "?X-Amz-Signature=1",
+                    "2023-08-01T01:00:00.000Z",
+                )
+            )
+        )
+
+
+class FakeBlocksChildren:
+    """Serves a synthetic page of `num_blocks` paragraphs, 100 per request.
+    Raw json is generated per request, as if it was decoded from the API."""
+
+    def __init__(self, num_blocks: int):
+        self.num_blocks = num_blocks
+
+    def make_block(self, i: int) -> Dict[str, Any]:
+        text = {
+            "type": "text",
+            "text": {"content": f"paragraph {i} " * 10, "link": None},
+            "plain_text": f"paragraph {i} " * 10,
+            "href": None,
+            "annotations": {
+                "bold": False,
+                "italic": False,
+                "strikethrough": False,
+                "underline": False,
+                "code": False,
+                "color": "default",
+            },
+        }
+        return {
+            "object": "block",
+            "id": f"block-{i}",
+            "created_time": "2023-08-01T00:00:00.000Z",
+            "last_edited_time": "2023-08-01T00:00:00.000Z",
+            "has_children": False,
+            "archived": False,
+            "type": "paragraph",
+            "paragraph": {"rich_text": [text, dict(text)], "color": "default"},
+        }
+
+    async def list(
+        self, block_id: str, start_cursor: Optional[str] = None, page_size: int = 100
+    ) -> Dict[str, Any]:
+        start = int(start_cursor or 0)
+        end = min(start + page_size, self.num_blocks)
+        return {
+            "results": [self.make_block(i) for i in range(start, end)],
+            "has_more": end < self.num_blocks,
+            "next_cursor": str(end) if end < self.num_blocks else None,
+        }
+
+
+class TestNotionProviderMemory:
+    @pytest.mark.asyncio
+    async def test_streaming_parse_peak_memory(self):
+        num_blocks = 5000
+        children = FakeBlocksChildren(num_blocks)
+        provider = NotionProvider(NotionProviderConfig(database_id="fake"))
+        provider.client.blocks.children = children  # type: ignore[misc]
+
+        # size of the raw json for the whole page
+        tracemalloc.start()
+        raw = (await children.list("page", page_size=num_blocks))["results"]
+        raw_size, _ = tracemalloc.get_traced_memory()
+        del raw
+        tracemalloc.stop()
+
+        tracemalloc.start()
+        blobs = await provider.async_fetch_block_content("page")
+        retained_size, peak_size = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        provider.cleanup()
+
+        assert len(blobs) == num_blocks
+        # only ~one request worth of raw json is alive at any point
+        assert peak_size - retained_size < raw_size / 10
+
+
+def make_text(text: str, href: Optional[str] = None) -> Dict[str, Any]:
+    return {"type": "text", "plain_text": text, "href": href, "annotations": {}}
+
+
+class FakeNotionClient:
+    """In-memory dbs, pages and blocks served through the subset of the
+    notion-client api used by the providers, 2 results per request."""
+
+    PAGE_SIZE = 2
+
+    def __init__(self) -> None:
+        self.db_schemas: Dict[str, Dict[str, Any]] = {}
+        self.db_pages: Dict[str, List[str]] = {}
+        self.page_store: Dict[str, Dict[str, Any]] = {}
+        self.children: Dict[str, List[Dict[str, Any]]] = {}
+        # secs to wait before serving the children of a block
+        self.delays: Dict[str, float] = {}
+        # pages and blocks not shared with the integration
+        self.missing: Set[str] = set()
+        # requests issued per page and block id
+        self.requests: Counter = Counter()
+        # secs to wait before serving a page, and peak concurrent requests
+        self.retrieve_delay = 0.0
+        self.retrieves_in_flight = self.max_retrieves_in_flight = 0
+        self.databases = SimpleNamespace(retrieve=self.retrieve_db, query=self.query_db)
+        self.pages = SimpleNamespace(retrieve=self.retrieve_page)
+        self.blocks = SimpleNamespace(children=SimpleNamespace(list=self.list_children))
+
+    def add_page(
+        self,
+        page_id: str,
+        title: str,
+        last_edited_time: str = "2023-08-01T00:00:00.000Z",
+        parent: Optional[Dict[str, str]] = None,
+        blocks: Optional[List[Dict[str, Any]]] = None,
+        **properties: Dict[str, Any],
+    ) -> None:
+        self.page_store[page_id] = {
+            "object": "page",
+            "archived": False,
+            "id": page_id,
+            "last_edited_time": last_edited_time,
+            "parent": parent or {"type": "workspace", "workspace": True},
+            "properties": {
+                "Name": {"type": "title", "title": [make_text(title)]},
+                **properties,
+            },
+            "url": f"https://www.notion.so/{page_id}",
+        }
+        self.children[page_id] = blocks or []
+        if parent and parent.get("database_id"):
+            self.db_pages.setdefault(parent["database_id"], []).append(page_id)
+
+    def paginate(
+        self, results: List[Dict[str, Any]], start_cursor: Optional[str]
+    ) -> Dict[str, Any]:
+        start = int(start_cursor or 0)
+        end = start + self.PAGE_SIZE
+        return {
+            "results": results[start:end],
+            "has_more": end < len(results),
+            "next_cursor": str(end) if end < len(results) else None,
+        }
+
+    async def retrieve_db(self, database_id: str) -> Dict[str, Any]:
+        return {"properties": self.db_schemas[database_id]}
+
+    async def query_db(
+        self, database_id: str, start_cursor: Optional[str] = None, **kwargs: Any
+    ) -> Dict[str, Any]:
+        return self.paginate(
+            [self.page_store[i] for i in self.db_pages.get(database_id, [])],
+            start_cursor,
+        )
+
+    def check_shared(self, object_id: str) -> None:
+        self.requests[object_id] += 1
+        if object_id in self.missing:
+            raise APIResponseError(
+                httpx.Response(404), "Could not find block", APIErrorCode.ObjectNotFound
+            )
+
+    async def retrieve_page(self, page_id: str) -> Dict[str, Any]:
+        self.check_shared(page_id)
+        self.retrieves_in_flight += 1
+        self.max_retrieves_in_flight = max(
+            self.max_retrieves_in_flight, self.retrieves_in_flight
+        )
+        try:
+            await asyncio.sleep(self.retrieve_delay)
+        finally:
+            self.retrieves_in_flight -= 1
+        return self.page_store[page_id]
+
+    async def list_children(
+        self, block_id: str, start_cursor: Optional[str] = None, **kwargs: Any
+    ) -> Dict[str, Any]:
+        self.check_shared(block_id)
+        await asyncio.sleep(self.delays.get(block_id, 0))
+        # fresh copies, the provider consumes the raw json
+        return self.paginate(
+            [dict(b) for b in self.children.get(block_id, [])], start_cursor
+        )
+
+
+def make_db_provider(client: FakeNotionClient, **kwargs: Any) -> NotionProvider:
+    client.db_schemas["db"] = {
+        "Name": {"type": "title", "title": {}},
+        "Rank": {"type": "number", "number": {}},
+        "Status": {"type": "select", "select": {}},
+    }
+    provider = NotionProvider(NotionProviderConfig(database_id="db", **kwargs))
+    provider.client = client  # type: ignore[assignment]
+    return provider
+
+
+class TestNotionProviderPriority:
+    def make_client(self) -> FakeNotionClient:
+        client = FakeNotionClient()
+        for page_id, edited, rank, status in [
+            ("a", "2023-08-01T00:00:00.000Z", 1, "Draft"),
+            ("b", "2023-08-03T00:00:00.000Z", None, "Ready"),
+            ("c", "2023-08-02T00:00:00.000Z", 3, "Done"),
+            ("d", "2023-07-01T00:00:00.000Z", 2, "Ready"),
+        ]:
+            client.add_page(
+                page_id,
+                f"Page {page_id}",
+                last_edited_time=edited,
+                parent={"type": "database_id", "database_id": "db"},
+                Rank={"type": "number", "number": rank},
+                Status={"type": "select", "select": {"name": status}},
+            )
+        return client
+
+    async def collect_ids(self, provider: NotionProvider) -> List[str]:
+        ids = [page.id async for page in provider.async_iterate()]
+        provider.cleanup()
+        return ids
+
+    @pytest.mark.asyncio
+    async def test_last_edited_time(self):
+        provider = make_db_provider(
+            self.make_client(),
+            priority_policy=PriorityPolicy.LAST_EDITED_TIME,
+            max_concurrent_pages=1,
+        )
+        assert await self.collect_ids(provider) == ["b", "c", "a", "d"]
+
+    @pytest.mark.asyncio
+    async def test_property(self):
+        # highest number first, pages without a value last
+        provider = make_db_provider(
+            self.make_client(),
+            priority_policy=PriorityPolicy.PROPERTY,
+            priority_property_key="Rank",
+            max_concurrent_pages=1,
+        )
+        assert await self.collect_ids(provider) == ["c", "d", "a", "b"]
+        # ranked values, unranked ones last
+        provider = make_db_provider(
+            self.make_client(),
+            priority_policy=PriorityPolicy.PROPERTY,
+            priority_property_key="Status",
+            priority_values=["Ready", "Draft"],
+            max_concurrent_pages=1,
+        )
+        assert await self.collect_ids(provider) == ["b", "d", "a", "c"]
+
+    @pytest.mark.asyncio
+    async def test_time_budget(self, caplog):
+        client = self.make_client()
+        client.delays["c"] = 10
+        provider = make_db_provider(
+            client,
+            priority_policy=PriorityPolicy.LAST_EDITED_TIME,
+            time_budget_secs=0.5,
+        )
+        start = time.monotonic()
+        # the slow page is cancelled without holding back the ones after it
+        assert await self.collect_ids(provider) == ["b", "a", "d"]
+        assert time.monotonic() - start < 2
+        assert "skipped 1 of 4 pages" in caplog.text
+
+
+def make_block(block_id: str, block_type: str, **content: Any) -> Dict[str, Any]:
+    return {
+        "object": "block",
+        "id": block_id,
+        "type": block_type,
+        "has_children": block_type in ("child_page", "child_database"),
+        block_type: content,
+    }
+
+
+class TestNotionProviderLinkedBlocks:
+    @pytest.mark.asyncio
+    async def test_synced_block_single_flight(self):
+        client = FakeNotionClient()
+        client.children["source"] = [
+            make_block("text", "paragraph", rich_text=[make_text("shared")])
+        ]
+        client.delays["source"] = 0.05
+        page_ids = [f"page-{i}" for i in range(5)]
+        for page_id in page_ids:
+            client.children[page_id] = [
+                make_block(
+                    f"{page_id}-synced",
+                    "synced_block",
+                    synced_from={"type": "block_id", "block_id": "source"},
+                )
+            ]
+        # the original block is the source of its duplicates
+        client.children["original"] = [
+            make_block("source", "synced_block", synced_from=None)
+        ]
+        provider = make_db_provider(client)
+        pages = await asyncio.gather(
+            *[
+                provider.async_fetch_block_content(page_id)
+                for page_id in [*page_ids, "original"]
+            ]
+        )
+        provider.cleanup()
+
+        assert client.requests["source"] == 1
+        for (synced,) in pages:
+            assert MarkdownStyler.process(synced).strip() == "shared"
+
+    @pytest.mark.asyncio
+    async def test_synced_block_not_shared(self, caplog):
+        client = FakeNotionClient()
+        client.missing.add("source")
+        for page_id in ["a", "b"]:
+            client.children[page_id] = [
+                make_block(
+                    f"{page_id}-synced",
+                    "synced_block",
+                    synced_from={"type": "block_id", "block_id": "source"},
+                ),
+                make_block(f"{page_id}-text", "paragraph", rich_text=[make_text("ok")]),
+            ]
+        provider = make_db_provider(client)
+        for page_id in ["a", "b"]:
+            synced, text = await provider.async_fetch_block_content(page_id)
+            # rendered empty, the rest of the page is kept
+            assert synced.children is None
+            assert MarkdownStyler.process(text).strip() == "ok"
+        provider.cleanup()
+
+        assert client.requests["source"] == 1
+        assert "Unable to fetch synced block source" in caplog.text
+
+    @pytest.mark.asyncio
+    async def test_page_links(self):
+        child, target, missing = [f"{i:032x}" for i in range(1, 4)]
+        client = FakeNotionClient()
+        client.add_page(target, "Target")
+        client.missing.add(missing)
+        client.children["page"] = [
+            make_block(child, "child_page", title="Child"),
+            make_block("link", "link_to_page", type="page_id", page_id=target),
+            make_block("link-2", "link_to_page", type="page_id", page_id=target),
+            make_block("broken", "link_to_page", type="page_id", page_id=missing),
+        ]
+        provider = make_db_provider(client)
+        blobs = await provider.async_fetch_block_content("page")
+        provider.cleanup()
+
+        assert [MarkdownStyler.process(blob).strip() for blob in blobs] == [
+            f"[Child](https://www.notion.so/{child})",
+            f"[Target](https://www.notion.so/{target})",
+            f"[Target](https://www.notion.so/{target})",
+            # not shared with the integration, linked to by url
+            f"[https://www.notion.so/{missing}](https://www.notion.so/{missing})",
+        ]
+        # link targets are fetched once per run
+        assert client.requests[target] == 1
+
+
+class TestNotionPageTreeProvider:
+    @pytest.mark.asyncio
+    async def test_crawl(self, tmp_path):
+        root, a, b, c, db, e = [f"{i:032x}" for i in range(1, 7)]
+        client = FakeNotionClient()
+        client.add_page(
+            root,
+            "Root",
+            blocks=[
+                make_block(a, "child_page", title="A"),
+                make_block(b, "child_page", title="B"),
+            ],
+        )
+        client.add_page(
+            a,
+            "A",
+            blocks=[
+                make_block(c, "child_page", title="C"),
+                make_block("link", "link_to_page", type="page_id", page_id=b),
+            ],
+        )
+        # C is nested under both A and B, crawled once under A
+        client.add_page(
+            b,
+            "B",
+            blocks=[
+                make_block(db, "child_database", title="Docs"),
+                make_block(c, "child_page", title="C"),
+            ],
+        )
+        client.add_page(c, "C")
+        client.add_page(e, "E", parent={"type": "database_id", "database_id": db})
+        client.delays[b] = 0.05
+
+        provider = NotionPageTreeProvider(
+            NotionPageTreeProviderConfig(
+                database_id="db",
+                root_page_id=root,
+                max_concurrent_pages=1,
+                rewrite_page_links=True,
+                post_name_property_key="Title",
+            )
+        )
+        provider.client = client  # type: ignore[assignment]
+        pages = [page async for page in provider.async_iterate()]
+        provider.cleanup()
+
+        assert {p.id: (p.section, p.is_section) for p in pages} == {
+            root: ((), True),
+            a: (("Root",), True),
+            b: (("Root",), True),
+            c: (("Root", "A"), False),
+            e: (("Root", "B"), False),
+        }
+        assert provider.get_page_ids() == {root, a, b, c, e}
+        page_a = next(p for p in pages if p.id == a)
+        assert [blob.rich_text[0].page_ref for blob in page_a.blobs] == [
+            "Root/A/C",
+            "Root/B",
+        ]
+
+        exporter = MarkdownExporter(
+            MarkdownExporterConfig(
+                parent_dir=str(tmp_path), post_name_property_key="Title"
+            )
+        )
+        await exporter.async_process_batch(pages)
+        await exporter.async_finalize()
+        for path in [
+            "Root/_index.md",
+            "Root/A/_index.md",
+            "Root/A/C/index.md",
+            "Root/B/_index.md",
+            "Root/B/E/index.md",
+        ]:
+            assert (tmp_path / path).exists(), path
+        text_a = (tmp_path / "Root" / "A" / "_index.md").read_text()
+        assert '({{< relref "C" >}})' in text_a
+        assert '({{< relref "../B" >}})' in text_a
+
+    @pytest.mark.asyncio
+    async def test_crawl_children_concurrently(self):
+        root, *child_ids = [f"{i:032x}" for i in range(1, 12)]
+        client = FakeNotionClient()
+        client.retrieve_delay = 0.05
+        client.add_page(
+            root,
+            "Root",
+            blocks=[
+                make_block(child_id, "child_page", title=f"Child {i}")
+                for i, child_id in enumerate(child_ids)
+            ],
+        )
+        for i, child_id in enumerate(child_ids):
+            client.add_page(child_id, f"Child {i}")
+
+        provider = NotionPageTreeProvider(
+            NotionPageTreeProviderConfig(
+                database_id="db",
+                root_page_id=root,
+                max_concurrent_pages=1,
+                post_name_property_key="Title",
+            )
+        )
+        provider.client = client  # type: ignore[assignment]
+        pages = [page async for page in provider.async_iterate()]
+        provider.cleanup()
+
+        # the child pages are discovered in parallel, not one after another
+        assert client.max_retrieves_in_flight > 1
+        assert {page.id: page.section for page in pages} == {
+            root: (),
+            **{child_id: ("Root",) for child_id in child_ids},
+        }
+
+
+class TestNotionProviderTableData:
+    @pytest.mark.asyncio
+    async def test_table_spill(self):
+        client = FakeNotionClient()
+        client.PAGE_SIZE = 100
+        for table_id, num_rows in [("large", 250), ("small", 5)]:
+            client.children[table_id] = [
+                make_block(f"{table_id}-{i}", "table_row", cells=[[make_text(f"r{i}")]])
+                for i in range(num_rows)
+            ]
+        client.children["page"] = [
+            dict(
+                make_block(
+                    table_id,
+                    "table",
+                    table_width=1,
+                    has_column_header=table_id == "small",
+                    has_row_header=False,
+                ),
+                has_children=True,
+            )
+            for table_id in ["large", "small"]
+        ]
+        provider = make_db_provider(client, table_data_row_threshold=100)
+        large, small = await provider.async_fetch_block_content("page")
+
+        # streamed to a data file rather than kept as children
+        assert large.children is None and large.file
+        with open(large.file) as fp:
+            assert [row for (row,) in csv.reader(fp)] == [f"r{i}" for i in range(250)]
+        assert MarkdownStyler.process(large).strip() == (
+            '{{< table-data src="table_large.csv" header="false" >}}'
+        )
+        assert small.file is None and len(small.children or []) == 5
+        provider.cleanup()
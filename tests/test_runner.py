@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+
+import asyncio
+import json
+from dataclasses import dataclass
+from typing import AsyncIterator, List, Set, Tuple
+
+import pytest
+
+from notion2hugo.base import (
+    BaseProvider,
+    BaseProviderConfig,
+    Blob,
+    BlobType,
+    ContentWithAnnotation,
+    PageContent,
+    register_handler,
+)
+from notion2hugo.exporter import MarkdownExporterConfig
+from notion2hugo.formatter import HugoFormatterConfig
+from notion2hugo.provider import NotionProviderConfig
+from notion2hugo.runner import Runner, RunnerConfig
+
+
+@dataclass(frozen=True)
+class FakeProviderConfig(BaseProviderConfig):
+    # (page id, content hash)
+    pages: Tuple[Tuple[str, str], ...] = ()
+    # (page id, linked page id)
+    links: Tuple[Tuple[str, str], ...] = ()
+
+
+@register_handler(FakeProviderConfig)
+class FakeProvider(BaseProvider):
+    def __init__(self, config: FakeProviderConfig):
+        super(FakeProvider, self).__init__(config)
+        self.config = config
+
+    async def async_iterate(self) -> AsyncIterator[PageContent]:
+        for page_id, content_hash in self.config.pages:
+            yield PageContent(
+                id=page_id,
+                blobs=[
+                    Blob(
+                        id=f"link-{target_id}",
+                        rich_text=[
+                            ContentWithAnnotation(
+                                plain_text=f"to {target_id}",
+                                href=f"https://www.notion.so/{target_id}",
+                                page_ref=target_id,
+                            )
+                        ],
+                        type=BlobType.PARAGRAPH,
+                        children=None,
+                        file=None,
+                        language=None,
+                        table_width=None,
+                        table_cells=None,
+                        is_checked=None,
+                    )
+                    for source_id, target_id in self.config.links
+                    if source_id == page_id
+                ],
+                properties={},
+                content_hash=content_hash,
+            )
+
+    def get_page_ids(self) -> Set[str]:
+        return {page_id for page_id, _ in self.config.pages}
+
+
+class TestRunnerConfig:
+    def test_page_links_slug_key(self, tmp_path):
+        exporter_config = MarkdownExporterConfig(
+            parent_dir=str(tmp_path), post_name_property_key="Title"
+        )
+        with pytest.raises(AssertionError):
+            RunnerConfig(
+                provider_config=NotionProviderConfig(
+                    database_id="db", rewrite_page_links=True
+                ),
+                formatter_config=HugoFormatterConfig(),
+                exporter_config=exporter_config,
+            )
+        # links are left to notion unless rewritten
+        RunnerConfig(
+            provider_config=NotionProviderConfig(database_id="db"),
+            formatter_config=HugoFormatterConfig(),
+            exporter_config=exporter_config,
+        )
+
+
+class TestRunnerBatches:
+    def make_runner(self, tmp_path, **kwargs) -> Runner:
+        return Runner(
+            RunnerConfig(
+                provider_config=FakeProviderConfig(),
+                formatter_config=HugoFormatterConfig(),
+                exporter_config=MarkdownExporterConfig(parent_dir=str(tmp_path)),
+                **kwargs,
+            )
+        )
+
+    async def iterate_pages(self, delays: List[float]) -> AsyncIterator[PageContent]:
+        for i, delay in enumerate(delays):
+            await asyncio.sleep(delay)
+            yield PageContent(id=str(i), blobs=[], properties={})
+
+    async def collect_batches(
+        self, runner: Runner, delays: List[float]
+    ) -> List[List[str]]:
+        return [
+            [page.id for page in batch]
+            async for batch in runner.async_iterate_batches(self.iterate_pages(delays))
+        ]
+
+    @pytest.mark.asyncio
+    async def test_batch_size(self, tmp_path):
+        runner = self.make_runner(tmp_path, batch_size=2)
+        # the last partial batch is flushed once the provider is done
+        assert await self.collect_batches(runner, [0] * 5) == [
+            ["0", "1"],
+            ["2", "3"],
+            ["4"],
+        ]
+
+    @pytest.mark.asyncio
+    async def test_batch_timeout(self, tmp_path):
+        runner = self.make_runner(tmp_path, batch_size=3, batch_timeout_secs=0.1)
+        # a slow page flushes the partial batch waiting on it
+        assert await self.collect_batches(runner, [0, 0, 0.5, 0, 0, 0]) == [
+            ["0", "1"],
+            ["2", "3", "4"],
+            ["5"],
+        ]
+
+
+class TestRunnerContentHash:
+    def run(self, tmp_path, pages, links=(), **formatter_kwargs) -> None:
+        Runner(
+            RunnerConfig(
+                provider_config=FakeProviderConfig(pages=pages, links=links),
+                formatter_config=HugoFormatterConfig(**formatter_kwargs),
+                exporter_config=MarkdownExporterConfig(
+                    parent_dir=str(tmp_path / "out"), clean_parent_dir=False
+                ),
+                content_hash_path=str(tmp_path / "hashes.json"),
+            )
+        ).run()
+
+    def mark_exported(self, tmp_path, *page_ids: str) -> None:
+        # replaced by the next export of the page, if any
+        for page_id in page_ids:
+            (tmp_path / "out" / page_id / "index.md").write_text("previous")
+
+    def is_exported(self, tmp_path, page_id: str) -> bool:
+        return (tmp_path / "out" / page_id / "index.md").read_text() != "previous"
+
+    def test_skip_unchanged(self, tmp_path):
+        self.run(tmp_path, (("a", "1"), ("b", "2")))
+        assert self.is_exported(tmp_path, "a") and self.is_exported(tmp_path, "b")
+
+        self.mark_exported(tmp_path, "a", "b")
+        self.run(tmp_path, (("a", "1"), ("b", "3")))
+        assert not self.is_exported(tmp_path, "a")
+        assert self.is_exported(tmp_path, "b")
+
+        # output removed since the last run
+        (tmp_path / "out" / "a" / "index.md").unlink()
+        self.run(tmp_path, (("a", "1"), ("b", "3")))
+        assert (tmp_path / "out" / "a" / "index.md").exists()
+
+        # formatter settings changed
+        self.mark_exported(tmp_path, "a", "b")
+        self.run(tmp_path, (("a", "1"), ("b", "3")), highlight_style="native")
+        assert self.is_exported(tmp_path, "a") and self.is_exported(tmp_path, "b")
+
+        # pages removed from the source are dropped, along with their output
+        self.run(tmp_path, (("a", "1"),), highlight_style="native")
+        assert set(json.loads((tmp_path / "hashes.json").read_text())) == {"a"}
+        assert (tmp_path / "out" / "a" / "index.md").exists()
+        assert not (tmp_path / "out" / "b").exists()
+
+    def test_unlinked_page_refs(self, tmp_path):
+        links = (("a", "b"),)
+        # b isn't exported, eg, skipped by the provider's time budget
+        self.run(tmp_path, (("a", "1"),), links)
+        post_a = tmp_path / "out" / "a" / "index.md"
+        assert "[to b](https://www.notion.so/b)" in post_a.read_text()
+        assert "a" not in json.loads((tmp_path / "hashes.json").read_text())
+
+        # a is exported again once b is, though unchanged
+        self.run(tmp_path, (("a", "1"), ("b", "2")), links)
+        assert '[to b]({{< relref "../b" >}})' in post_a.read_text()
+        assert "a" in json.loads((tmp_path / "hashes.json").read_text())
+
+        # b deleted from the source, a is unlinked though skipped as unchanged
+        self.run(tmp_path, (("a", "1"),), links)
+        assert "[to b](https://www.notion.so/b)" in post_a.read_text()
+        assert "a" not in json.loads((tmp_path / "hashes.json").read_text())
+
+    def test_clean_parent_dir(self, tmp_path):
+        # unchanged pages would be skipped after their output was wiped
+        with pytest.raises(AssertionError):
+            RunnerConfig(
+                provider_config=FakeProviderConfig(),
+                formatter_config=HugoFormatterConfig(),
+                exporter_config=MarkdownExporterConfig(parent_dir=str(tmp_path)),
+                content_hash_path=str(tmp_path / "hashes.json"),
+            )
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+import json
+import shutil
+import sqlite3
+
+from notion2hugo.taxonomy import TaxonomyIndex, get_data_file_name
+
+
+class TestTaxonomyIndex:
+    def test_incremental_update(self, tmp_path):
+        db_path = str(tmp_path / "index.sqlite")
+        data_dir = tmp_path / "data"
+        index = TaxonomyIndex(db_path)
+        index.update_page("1", "post-1", {("Tags", "a"), ("Tags", "b")})
+        index.update_page("2", "post-2", {("Tags", "a")})
+        index.update_page("3", "post-3", {("Tags", "c")})
+        index.write_data_files(str(data_dir), top_k=5)
+        index.close()
+
+        related = json.loads(
+            (data_dir / "related" / get_data_file_name("post-1")).read_text()
+        )
+        assert related == {
+            "path": "post-1",
+            "related": [{"path": "post-2", "score": 1}],
+        }
+        tag_a = json.loads(
+            (data_dir / "taxonomies" / "tags" / get_data_file_name("a")).read_text()
+        )
+        assert tag_a == {"term": "a", "pages": ["post-1", "post-2"]}
+
+        # only pages sharing the changed terms are affected
+        index = TaxonomyIndex(db_path)
+        assert not index.update_page("1", "post-1", {("Tags", "a"), ("Tags", "b")})
+        assert index.update_page("2", "post-2", {("Tags", "b")})
+        assert index.changed_terms == {("Tags", "a"), ("Tags", "b")}
+        assert index.get_affected_pages() == {"1", "2"}
+        index.write_data_files(str(data_dir), top_k=5)
+        index.close()
+
+        tag_a = json.loads(
+            (data_dir / "taxonomies" / "tags" / get_data_file_name("a")).read_text()
+        )
+        assert tag_a == {"term": "a", "pages": ["post-1"]}
+
+    def test_data_file_names(self):
+        terms = ["日本", "中文", "C++", "C", "c", "Deep Learning", "deep-learning"]
+        post_paths = ["a/b", "ab", "a-b", "docs/overview", "guides/overview"]
+        names = [get_data_file_name(name) for name in terms + post_paths]
+        assert len(set(names)) == len(terms + post_paths)
+        assert all(not name.startswith(".") for name in names)
+        assert get_data_file_name("Deep Learning").startswith("deep-learning-")
+
+    def test_remove_page(self, tmp_path):
+        data_dir = tmp_path / "data"
+        index = TaxonomyIndex(str(tmp_path / "index.sqlite"))
+        index.update_page("1", "post-1", {("Tags", "a")})
+        index.update_page("2", "post-2", {("Tags", "a")})
+        index.write_data_files(str(data_dir), top_k=5)
+
+        # page 2 deleted from notion
+        index.remove_page("2")
+        assert index.get_page_ids() == {"1"}
+        index.write_data_files(str(data_dir), top_k=5)
+        index.close()
+
+        tag_a = data_dir / "taxonomies" / "tags" / get_data_file_name("a")
+        assert json.loads(tag_a.read_text()) == {"term": "a", "pages": ["post-1"]}
+        assert not (data_dir / "related" / get_data_file_name("post-2")).exists()
+        related = json.loads(
+            (data_dir / "related" / get_data_file_name("post-1")).read_text()
+        )
+        assert related == {"path": "post-1", "related": []}
+
+    def test_post_paths(self, tmp_path):
+        # crawled pages with the same slug in different sections
+        data_dir = tmp_path / "data"
+        index = TaxonomyIndex(str(tmp_path / "index.sqlite"))
+        index.update_page("1", "docs/overview", {("Tags", "a")})
+        index.update_page("2", "guides/overview", {("Tags", "a")})
+        index.write_data_files(str(data_dir), top_k=5)
+
+        tag_a = data_dir / "taxonomies" / "tags" / get_data_file_name("a")
+        assert json.loads(tag_a.read_text())["pages"] == [
+            "docs/overview",
+            "guides/overview",
+        ]
+        related = json.loads(
+            (data_dir / "related" / get_data_file_name("docs/overview")).read_text()
+        )
+        assert related == {
+            "path": "docs/overview",
+            "related": [{"path": "guides/overview", "score": 1}],
+        }
+
+        # data files wiped while the index survived are written again
+        shutil.rmtree(data_dir)
+        assert not index.update_page("1", "docs/overview", {("Tags", "a")})
+        index.write_data_files(str(data_dir), top_k=5)
+        index.close()
+        assert json.loads(tag_a.read_text())["pages"] == [
+            "docs/overview",
+            "guides/overview",
+        ]
+        for post_path in ["docs/overview", "guides/overview"]:
+            assert (data_dir / "related" / get_data_file_name(post_path)).exists()
+
+    def test_schema_version(self, tmp_path):
+        db_path = str(tmp_path / "index.sqlite")
+        db = sqlite3.connect(db_path)
+        db.executescript(
+            "CREATE TABLE pages (page_id TEXT PRIMARY KEY, slug TEXT NOT NULL);"
+            "INSERT INTO pages VALUES ('1', 'post-1');"
+        )
+        db.commit()
+        db.close()
+        # rebuilt, its pages are exported again
+        index = TaxonomyIndex(db_path)
+        assert not index.has_page("1")
+        assert index.update_page("1", "post-1", {("Tags", "a")})
+        index.close()